@@ -4,26 +4,45 @@ import os
 import numpy as np
 import pandas as pd
 
-from .config import AIGRAIN_DIR
-from .lc import LightCurve, qtr_times
+from .config import AIGRAIN_DIR, AIGRAIN_BINARY_DIR
+from .lc import LightCurve, quarter_slices
+from .archive import open_archive, build_aigrain_archive, INDEX_FILE
 
 from .summary import corner_plot
 
 def get_true_period(i):
-    lc = AigrainLightCurve(i)
-    P1, P2 = lc.sim_params.P_MIN, lc.sim_params.P_MAX
+    sim_params = AigrainTruths().df.loc[i]
+    P1, P2 = sim_params.P_MIN, sim_params.P_MAX
     return (P1, P2)
 
+def convert_aigrain(stars=None, verbose=False):
+    """Converts Aigrain simulation directory into binary form
+
+    Light curves in `final` and `noise_free` become light curve archives
+    (see `gprot.archive`) in AIGRAIN_BINARY_DIR (default
+    $AIGRAIN_ROTATION/binary), and the truth table becomes a .npy file.
+    Loaders use these automatically once they exist.
+    """
+    for subdir in ('final', 'noise_free'):
+        if not os.path.exists(os.path.join(AIGRAIN_DIR, subdir)):
+            continue
+        if verbose:
+            print('Converting {}...'.format(subdir))
+        build_aigrain_archive(os.path.join(AIGRAIN_BINARY_DIR, subdir),
+                              stars=stars, subdir=subdir)
+
+    df = pd.read_table(AigrainTruths.filename, delim_whitespace=True)
+    np.save(AigrainTruths.binary_filename, df.to_records(index=False))
+
 class AigrainLightCurve(LightCurve):
     subdir = 'final'
+    chunk_quarters = True
+
     def __init__(self, i, ndays=None, sub=40, rng=None, nsigma=5, 
-                 quarters=None, **kwargs):
+                 quarters=None, archive=None, **kwargs):
         self.i = i
 
-        sid = str(int(i)).zfill(4)
-        x, y = np.genfromtxt(os.path.join(AIGRAIN_DIR, self.subdir,
-                             "lightcurve_{0}.txt".format(sid))).T
-        yerr = np.ones(len(y)) * 1e-5
+        x, y, yerr = self._read_data(i, archive=archive)
 
         if quarters is None:
             self.quarters = None
@@ -34,27 +53,45 @@ class AigrainLightCurve(LightCurve):
                 self.quarters = [quarters]
 
         if quarters is not None:
-            m = np.zeros(x.shape).astype(bool)
-            for qtr in self.quarters:
-                t0, t1 = qtr_times.ix[qtr, ['tstart', 'tstop']]
-                m |= (x >= t0) & (x <= t1)
-            x = x[m]
-            y = y[m]
-            yerr = yerr[m]
+            index = quarter_slices(x, self.quarters)
+            x = np.concatenate([x[sl] for sl in index.values()])
+            y = np.concatenate([y[sl] for sl in index.values()])
+            yerr = np.concatenate([yerr[sl] for sl in index.values()])
 
-        super(AigrainLightCurve, self).__init__(x, y - 1, yerr, sub=sub, **kwargs)
+        super(AigrainLightCurve, self).__init__(x, y, yerr, sub=sub, **kwargs)
 
         # Restrict range if desired
         if rng is not None:
-            self.restrict_range(rng)
+            self.restrict_range(rng, compress=False)
         elif ndays is not None:
-            self.restrict_range((0, ndays))
+            self.restrict_range((0, ndays), compress=False)
 
         if nsigma is not None:
             self.sigma_clip(nsigma)
 
         self._sim_params = None
 
+    @classmethod
+    def _read_data(cls, i, archive=None):
+        """Returns x, y - 1, yerr; from binary archive if available
+
+        archive (path or `LightCurveArchive`), if given, is used instead
+        of the default binary archive.
+        """
+        if archive is not None:
+            return open_archive(archive)[i]
+
+        path = os.path.join(AIGRAIN_BINARY_DIR, cls.subdir)
+        if os.path.exists(os.path.join(path, INDEX_FILE)):
+            archive = open_archive(path)
+            if i in archive:
+                return archive[i]
+
+        sid = str(int(i)).zfill(4)
+        x, y = np.genfromtxt(os.path.join(AIGRAIN_DIR, cls.subdir,
+                             "lightcurve_{0}.txt".format(sid))).T
+        return x, y - 1, np.ones(len(y)) * 1e-5
+
     @property
     def name(self):
         if not hasattr(self, '_name') or self._name is None:
@@ -85,13 +122,13 @@ class AigrainLightCurve(LightCurve):
 
     #     super(AigrainLightCurve, self).multi_split_quarters(qtrs, subs, seed=self.i)
 
-    def sigma_clip(self, nsigma=5):
-        super(AigrainLightCurve, self).sigma_clip(nsigma)
+    def sigma_clip(self, nsigma=5, **kwargs):
+        super(AigrainLightCurve, self).sigma_clip(nsigma, **kwargs)
 
     @property
     def sim_params(self):
         if self._sim_params is None:
-            self._sim_params = AigrainTruths().df.ix[self.i]
+            self._sim_params = AigrainTruths().df.loc[self.i]
         return self._sim_params
 
     def corner_plot(self, samples, **kwargs):
@@ -114,14 +151,20 @@ class AigrainLightCurve(LightCurve):
 class NoiseFreeAigrainLightCurve(AigrainLightCurve):
     subdir = 'noise_free'
 
+_truths_df = None
+
 class AigrainTruths(object):
+    """Simulation parameters; loaded once per process and shared
+    """
     filename = os.path.join(AIGRAIN_DIR, 'par', 'final_table.txt')
-
-    def __init__(self):
-        self._df = None
+    binary_filename = os.path.join(AIGRAIN_BINARY_DIR, 'final_table.npy')
 
     @property
     def df(self):
-        if self._df is None:
-            self._df = pd.read_table(self.filename, delim_whitespace=True)
-        return self._df
+        global _truths_df
+        if _truths_df is None:
+            if os.path.exists(self.binary_filename):
+                _truths_df = pd.DataFrame(np.load(self.binary_filename))
+            else:
+                _truths_df = pd.read_table(self.filename, delim_whitespace=True)
+        return _truths_df
@@ -0,0 +1,134 @@
+from __future__ import print_function, division
+
+import os
+import numpy as np
+
+from .config import AIGRAIN_DIR, ARCHIVE_DIR
+
+# Archive layout (a directory):
+#   columns.bin : float64 data of all stars concatenated; each star is a
+#                 contiguous (3, n) block, i.e., its x, then y, then yerr.
+#   index.npy   : structured array of (id, start, stop) point offsets
+#                 (star data are values 3*start to 3*stop).
+COLUMNS_FILE = 'columns.bin'
+INDEX_FILE = 'index.npy'
+INDEX_DTYPE = [('id', '<i8'), ('start', '<i8'), ('stop', '<i8')]
+
+_open_archives = {}
+
+class LightCurveArchive(object):
+    """Memory-mapped archive of many light curves
+
+    Indexing by star ID returns a read-only (3, N) view of that star's
+    x, y, yerr, without reading or parsing anything else.
+
+    Parameters
+    ----------
+    path : str
+        Archive directory, as written by `write_archive`.
+    """
+    def __init__(self, path):
+        self.path = path
+        index = np.load(os.path.join(path, INDEX_FILE))
+        self._offsets = dict((int(i), (int(i0), int(i1)))
+                             for i, i0, i1 in index)
+        self._columns = None
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._columns = np.memmap(os.path.join(self.path, COLUMNS_FILE),
+                                      dtype='<f8', mode='r')
+        return self._columns
+
+    @property
+    def stars(self):
+        return sorted(self._offsets.keys())
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __contains__(self, star_id):
+        return int(star_id) in self._offsets
+
+    def __getitem__(self, star_id):
+        i0, i1 = self._offsets[int(star_id)]
+        return self.columns[3*i0:3*i1].reshape(3, i1 - i0)
+
+def open_archive(path=None):
+    """Returns (per-process shared) LightCurveArchive at path
+
+    Default path is $GPROT_ARCHIVE.
+    """
+    if isinstance(path, LightCurveArchive):
+        return path
+    if path is None:
+        path = ARCHIVE_DIR
+    if path is None:
+        raise ValueError('No archive path given, and GPROT_ARCHIVE not set.')
+    path = os.path.abspath(path)
+    if path not in _open_archives:
+        _open_archives[path] = LightCurveArchive(path)
+    return _open_archives[path]
+
+def write_archive(path, light_curves, verbose=False):
+    """Writes light curves to a new archive
+
+    Parameters
+    ----------
+    path : str
+        Archive directory (created if necessary; existing archive is
+        overwritten).
+
+    light_curves : iterable
+        Yields (star_id, x, y, yerr) for each star.  Only one star is held
+        in memory at a time.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    index = []
+    n = 0
+    with open(os.path.join(path, COLUMNS_FILE), 'wb') as f:
+        for star_id, x, y, yerr in light_curves:
+            np.array((x, y, yerr), dtype='<f8').tofile(f)
+            index.append((star_id, n, n + len(x)))
+            n += len(x)
+            if verbose:
+                print('{}: {} points'.format(star_id, len(x)))
+
+    np.save(os.path.join(path, INDEX_FILE), np.array(index, dtype=INDEX_DTYPE))
+
+    # Make sure a re-opened archive is not stale.
+    _open_archives.pop(os.path.abspath(path), None)
+
+def _aigrain_light_curves(stars, subdir):
+    for i in stars:
+        sid = str(int(i)).zfill(4)
+        x, y = np.loadtxt(os.path.join(AIGRAIN_DIR, subdir,
+                                       "lightcurve_{0}.txt".format(sid))).T
+        yield i, x, y - 1, np.ones(len(y)) * 1e-5
+
+def build_aigrain_archive(path, stars=None, subdir='final', verbose=False):
+    """Converts Aigrain simulation text files into an archive
+
+    Data are stored as `AigrainLightCurve` uses them (flux - 1, yerr=1e-5).
+    Default is all 1000 stars.
+    """
+    if stars is None:
+        stars = range(1000)
+    write_archive(path, _aigrain_light_curves(stars, subdir), verbose=verbose)
+
+def _kepler_light_curves(stars, **kwargs):
+    from .kepler import KeplerLightCurve
+    for kid in stars:
+        lc = KeplerLightCurve(kid, **kwargs)
+        yield kid, lc.x_full, lc.y_full, lc.yerr_full
+
+def build_kepler_archive(path, stars, verbose=False, **kwargs):
+    """Writes cleaned, stitched Kepler light curves into an archive
+
+    Keyword arguments are passed to `KeplerLightCurve`.  Stars are stored
+    under the ID they are given by (KOI or KIC number).
+    """
+    write_archive(path, _kepler_light_curves(stars, **kwargs), verbose=verbose)
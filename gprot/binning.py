@@ -0,0 +1,97 @@
+from __future__ import print_function, division
+
+import numpy as np
+
+class StreamingBinner(object):
+    """Inverse-variance weighted binning of time-ordered data, in pieces
+
+    Data are added in consecutive, time-sorted blocks (e.g., rows of a
+    FITS table), and only running sums per bin are kept, so memory
+    scales with the number of bins, not the number of points.  Bins are
+    fixed intervals [t0 + k*binsize, t0 + (k+1)*binsize); empty bins are
+    simply absent.
+
+    Parameters
+    ----------
+    binsize : float
+        Bin width (days).
+
+    t0 : float
+        Origin of the bin grid.
+    """
+    def __init__(self, binsize, t0=0.):
+        self.binsize = binsize
+        self.t0 = t0
+
+        # Sums (w, w*t, w*y) for completed bins, and for the last bin,
+        # which the next block may still add to.
+        self._sums = []
+        self._last = None
+
+    def add(self, t, y, yerr):
+        """Adds block of points, all later than those previously added
+        """
+        if len(t) == 0:
+            return
+
+        ids = np.floor((t - self.t0) / self.binsize).astype(np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1))
+        w = 1. / yerr**2
+        sums = np.array([np.add.reduceat(w, starts),
+                         np.add.reduceat(w * t, starts),
+                         np.add.reduceat(w * y, starts)])
+        ids = ids[starts]
+
+        if self._last is not None:
+            last_id, last_sums = self._last
+            if last_id == ids[0]:
+                sums[:, 0] += last_sums
+            else:
+                self._sums.append(last_sums[:, None])
+
+        self._sums.append(sums[:, :-1])
+        self._last = (ids[-1], sums[:, -1])
+
+    def result(self):
+        """Returns binned time, y, yerr
+
+        Time is the weighted mean time of the points in each bin, and
+        yerr the propagated error of the weighted mean.
+        """
+        sums = list(self._sums)
+        if self._last is not None:
+            sums.append(self._last[1][:, None])
+        if len(sums) == 0:
+            return np.array([]), np.array([]), np.array([])
+        sw, swt, swy = np.concatenate(sums, axis=1)
+        return swt / sw, swy / sw, 1. / np.sqrt(sw)
+
+def bin_weighted(x, y, yerr, nbin, maxgap=None):
+    """Averages groups of nbin consecutive points, never across gaps
+
+    Points are split into segments wherever the time step exceeds maxgap
+    (default: 5 times the median step), and each segment is cut into bins
+    of nbin points (the last bin of a segment may have fewer).  Bins are
+    inverse-variance weighted means, with propagated errors.
+
+    Returns binned x, y, yerr.
+    """
+    x, y, yerr = np.asarray(x), np.asarray(y), np.asarray(yerr)
+    N = len(x)
+    if N == 0 or nbin <= 1:
+        return x, y, yerr
+
+    dx = np.diff(x)
+    if maxgap is None:
+        maxgap = 5 * np.median(dx) if N > 1 else np.inf
+
+    # Start index of each segment, and of each bin within it.
+    seg_starts = np.concatenate(([0], np.flatnonzero(dx > maxgap) + 1))
+    seg_index = np.repeat(seg_starts, np.diff(np.append(seg_starts, N)))
+    starts = np.flatnonzero((np.arange(N) - seg_index) % nbin == 0)
+
+    w = 1. / yerr**2
+    sw = np.add.reduceat(w, starts)
+    return (np.add.reduceat(w * x, starts) / sw,
+            np.add.reduceat(w * y, starts) / sw,
+            1. / np.sqrt(sw))
@@ -2,4 +2,11 @@ import os
 
 AIGRAIN_DIR = os.getenv('AIGRAIN_ROTATION', 
                         "../code/simulations/kepler_diffrot_full")
-POLYCHORD = os.getenv('POLYCHORD', os.path.expanduser('~/PolyChord'))
\ No newline at end of file
+AIGRAIN_BINARY_DIR = os.getenv('AIGRAIN_ROTATION_BINARY',
+                               os.path.join(AIGRAIN_DIR, 'binary'))
+POLYCHORD = os.getenv('POLYCHORD', os.path.expanduser('~/PolyChord'))
+LC_CACHE_DIR = os.getenv('GPROT_LC_CACHE',
+                         os.path.expanduser('~/.gprot/lc_cache'))
+ARCHIVE_DIR = os.getenv('GPROT_ARCHIVE')
+KOI_TABLE = os.getenv('GPROT_KOI_TABLE',
+                      os.path.expanduser('~/.gprot/koi_table.npy'))
@@ -0,0 +1,99 @@
+from __future__ import print_function, division
+
+import os
+import glob
+
+from .koi import KOITable
+
+class FakeLightCurve(object):
+    """Stand-in for `kplr.api.LightCurve`: a local FITS file
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def open(self, **kwargs):
+        from astropy.io import fits
+        return fits.open(self.filename, **kwargs)
+
+class FakeStar(object):
+    """Stand-in for `kplr.api.Star`
+
+    Parameters
+    ----------
+    kepid : int
+        KIC ID.
+
+    filenames : list
+        FITS files for this star; short-cadence files end in `_slc.fits`.
+    """
+    def __init__(self, kepid, filenames):
+        self.kepid = int(kepid)
+        self.filenames = sorted(filenames)
+
+    def get_light_curves(self, short_cadence=False, clobber=False, **kwargs):
+        # Like kplr, short_cadence=True returns both cadences.
+        return [FakeLightCurve(f) for f in self.filenames
+                if short_cadence or not f.endswith('_slc.fits')]
+
+class FakeKOI(FakeStar):
+    """Stand-in for `kplr.api.KOI`, built from a `KOITable` row
+    """
+    def __init__(self, row, koi_count, filenames):
+        super(FakeKOI, self).__init__(row['kepid'], filenames)
+        self.kepoi_name = 'K{:08.2f}'.format(row['koi'])
+        self.koi_period = float(row['koi_period'])
+        self.koi_time0bk = float(row['koi_time0bk'])
+        self.koi_duration = float(row['koi_duration'])
+        self.koi_count = koi_count
+
+class FakeClient(object):
+    """Local stand-in for `kplr.API`, e.g. for tests
+
+    Answers `koi` and `star` from a `KOITable` and a directory of
+    FITS files named as on MAST (`kplr{kepid:09d}-*_llc.fits` or
+    `*_slc.fits`), so `KeplerLightCurve(..., client=...)`
+    needs no network or kplr database.
+
+    Parameters
+    ----------
+    koi_table : KOITable, optional
+        KOI parameters.
+
+    fits_dir : str, optional
+        Directory (searched recursively) of FITS files.
+
+    light_curves : dict, optional
+        Explicit mapping of KIC ID to list of FITS files; overrides
+        `fits_dir` for those stars.
+    """
+    def __init__(self, koi_table=None, fits_dir=None, light_curves=None):
+        if koi_table is None:
+            koi_table = KOITable([])
+        self.koi_table = koi_table
+        self.fits_dir = fits_dir
+        self.light_curves = dict(light_curves or {})
+
+    def _filenames(self, kepid):
+        kepid = int(kepid)
+        if kepid in self.light_curves:
+            return self.light_curves[kepid]
+        if self.fits_dir is None:
+            return []
+        filenames = []
+        for root, dirs, files in os.walk(self.fits_dir):
+            for suffix in ('_llc.fits', '_slc.fits'):
+                pattern = 'kplr{:09d}-*{}'.format(kepid, suffix)
+                filenames += glob.glob(os.path.join(root, pattern))
+        return filenames
+
+    def koi(self, koi):
+        koinum = int(koi)
+        planets = self.koi_table.planets(koinum=koinum)
+        match = abs(planets['koi'] - koi) < 1e-6
+        if not match.any():
+            raise KeyError('KOI {} not in table.'.format(koi))
+        row = planets[match][0]
+        return FakeKOI(row, len(planets), self._filenames(row['kepid']))
+
+    def star(self, kepid):
+        return FakeStar(kepid, self._filenames(kepid))
@@ -1,13 +1,154 @@
 import numpy as np
 from scipy.signal import butter, lfilter
+from scipy.special import comb
 
 
-def sigma_clip(x, y, yerr, nsigma):
-    med = np.median(y)
-    std = (sum((med - y)**2)/float(len(y)))**.5
-    m = np.abs(y - med) > (nsigma * std)
+def sigma_clip_mask(y, nsigma, maxiter=1, robust=False, mask=None):
+    """Returns boolean mask of points within nsigma of the median of y
 
-    return x[~m], y[~m], yerr[~m]    
+    Scale is the rms about the median, or the normalized median absolute
+    deviation if robust=True.  Clipping is repeated until no more points
+    are rejected or maxiter passes are made (maxiter=None to iterate to
+    convergence).
+
+    If mask is provided, points already masked out are ignored and the
+    mask is updated in place.
+    """
+    if mask is None:
+        mask = np.isfinite(y)
+
+    resid = np.empty(len(y))
+    n_good = mask.sum()
+    i = 0
+    while n_good > 0 and (maxiter is None or i < maxiter):
+        med = np.median(y[mask])
+        np.subtract(y, med, out=resid)
+        np.absolute(resid, out=resid)
+        if robust:
+            scale = 1.4826 * np.median(resid[mask])
+        else:
+            scale = np.sqrt(np.mean(resid[mask]**2))
+        mask &= resid <= nsigma * scale
+
+        n = mask.sum()
+        if n == n_good:
+            break
+        n_good = n
+        i += 1
+
+    return mask
+
+def sigma_clip(x, y, yerr, nsigma, maxiter=1, robust=False):
+    m = sigma_clip_mask(y, nsigma, maxiter=maxiter, robust=robust)
+    return x[m], y[m], yerr[m]
+
+class RollingPolyVariance(object):
+    """Residual scatter of polynomial fits in sliding windows
+
+    Prefix sums of the moments sum(w t^k), sum(w t^k y) and sum(w y^2) are
+    accumulated once, so that the least-squares residual rms of any window
+    x[i1:i2] comes out in O(order^3), independent of window length.
+
+    To keep the normal equations well conditioned, times are measured from
+    local origins spaced by a block length of 2^m points (the smallest
+    block at least as long as the window); moments for each block length
+    are built once on first use and shared by all window sizes that need it.
+
+    Parameters
+    ----------
+    x, y : array_like
+        Sorted times and fluxes.
+
+    order : int
+        Order of the polynomial removed from each window.
+
+    mask : array_like, optional
+        Boolean mask of points to use; others get zero weight.
+    """
+    def __init__(self, x, y, order=3, mask=None):
+        self.x = x
+        self.order = order
+        if mask is None:
+            self._w = np.ones(len(x))
+            self._y = y - np.median(y)
+        else:
+            self._w = mask.astype(float)
+            self._y = y - np.median(y[mask])
+
+        self._n = np.concatenate([[0.], np.cumsum(self._w)])
+        self._yy = np.concatenate([[0.], np.cumsum(self._w * self._y**2)])
+
+        self._blocks = {}
+
+    def _block_moments(self, L):
+        if L not in self._blocks:
+            N = len(self.x)
+            p = self.order
+            nblocks = (N - 1)//L + 1
+            origins = self.x[np.minimum(np.arange(nblocks)*L + L//2, N - 1)]
+            dx = self.x - np.repeat(origins, L)[:N]
+
+            S = np.zeros((2*p + 1, N + 1))
+            B = np.zeros((p + 1, N + 1))
+            dxk = self._w.copy()
+            for k in range(2*p + 1):
+                np.cumsum(dxk, out=S[k, 1:])
+                if k <= p:
+                    np.cumsum(dxk * self._y, out=B[k, 1:])
+                dxk *= dx
+            self._blocks[L] = (origins, S, B)
+
+        return self._blocks[L]
+
+    def std(self, i1, i2):
+        """Returns rms of polynomial-fit residuals of each window x[i1:i2]
+
+        Windows with too few points to constrain the fit return nan.
+        """
+        i1 = np.atleast_1d(i1)
+        i2 = np.atleast_1d(i2)
+        p = self.order
+
+        W = max(int(np.max(i2 - i1)), 2)
+        L = 1 << int(np.ceil(np.log2(W)))
+        origins, S, B = self._block_moments(L)
+
+        # Moments of u = (x - center)/halfwidth for each window, summed
+        # over the (at most two) blocks that the window touches.
+        center = 0.5 * (self.x[i1] + self.x[i2 - 1])
+        halfwidth = 0.5 * (self.x[i2 - 1] - self.x[i1])
+        halfwidth[halfwidth <= 0] = 1.
+        split = np.maximum(((i2 - 1)//L)*L, i1)
+
+        Su = np.zeros((2*p + 1, len(i1)))
+        Bu = np.zeros((p + 1, len(i1)))
+        for lo, hi, o in ((i1, split, origins[i1//L]),
+                          (split, i2, origins[(i2 - 1)//L])):
+            dS = S[:, hi] - S[:, lo]
+            dB = B[:, hi] - B[:, lo]
+            shift = (o - center) / halfwidth
+            for k in range(2*p + 1):
+                for j in range(k + 1):
+                    a = comb(k, j) * shift**(k - j) / halfwidth**j
+                    Su[k] += a * dS[j]
+                    if k <= p:
+                        Bu[k] += a * dB[j]
+
+        n = self._n[i2] - self._n[i1]
+        yy = self._yy[i2] - self._yy[i1]
+
+        inds = np.arange(p + 1)
+        G = Su[inds[:, None] + inds[None, :]].transpose(2, 0, 1)
+        b = Bu.T
+
+        std = np.nan * np.ones(len(i1))
+        ok = n > p + 1
+        if ok.any():
+            coeffs = np.linalg.solve(G[ok], b[ok][..., None])[..., 0]
+            rss = yy[ok] - (coeffs * b[ok]).sum(axis=1)
+            std[ok] = np.sqrt(np.maximum(rss, 0) / n[ok])
+
+        return std
 
 def butter_bandpass(lowcut, highcut, fs, order=5):
     nyq = 0.5 * fs
@@ -26,42 +167,27 @@ def fill_gaps(x, y, yerr, cadence=1766./86400, make_uniform=True):
     if cadence is None:
         cadence = np.median(np.diff(x))
 
-    new_x = x.copy()
-    new_y = y.copy()
-    new_yerr = yerr.copy()
-    
     # Find data gaps.
     dx = np.diff(x)
     i_gaps = np.where(dx > 1.5*cadence)[0]
 
     # Make gap filler arrays, using linear interpolation
-    x_gaps = []
-    y_gaps = []
-    yerr_gaps = []
-    for i in i_gaps:
-        x0, x1 = x[i:i+2]
-        y0, y1 = y[i:i+2]
-        xfill = np.arange(x0 + cadence, x1, cadence)
-        x_gaps.append(xfill)
-        y_gaps.append(y0 + (xfill - x0)*(y1 - y0)/(x1 - x0))
-        yerr_gaps.append(np.ones(len(xfill)) * yerr[i])
-        
-    # Insert gap fillers into gaps
-    shift = 1
-    i_new = []
-    for i, xg, yg, yerrg in zip(i_gaps, x_gaps, y_gaps, yerr_gaps):
-        ind = i + shift
-        new_x = np.insert(new_x, ind, xg)
-        new_y = np.insert(new_y, ind, yg)
-        new_yerr = np.insert(new_yerr, ind, yerrg)
-        n = len(xg)
-        i_new.append(np.arange(ind, ind+n))
-        shift += n
-    
-    if len(i_new) > 0:
-        i_new = np.concatenate(i_new)
+    x_gaps = [np.arange(x[i] + cadence, x[i+1], cadence) for i in i_gaps]
+    n_gaps = np.array([len(xg) for xg in x_gaps], dtype=int)
+    i0 = np.repeat(i_gaps, n_gaps)
+    i1 = i0 + 1
+    if len(x_gaps) > 0:
+        x_fill = np.concatenate(x_gaps)
     else:
-        i_new = np.array([])
+        x_fill = np.array([])
+    y_fill = y[i0] + (x_fill - x[i0])*(y[i1] - y[i0])/(x[i1] - x[i0])
+    yerr_fill = yerr[i0]
+
+    # Insert gap fillers into gaps, all at once
+    new_x = np.insert(x, i1, x_fill)
+    new_y = np.insert(y, i1, y_fill)
+    new_yerr = np.insert(yerr, i1, yerr_fill)
+    i_new = i1 + np.arange(len(i1))
 
     if make_uniform:
         # Regularize x to be exactly according to cadence
@@ -71,7 +197,10 @@ def fill_gaps(x, y, yerr, cadence=1766./86400, make_uniform=True):
 
 def bandpass_filter(x, y, yerr, pmin=0.5, pmax=100, cadence=1766./86400,
                     edge=2000, order=3, zero_fill=False):
-    x, y, yerr, i_new = fill_gaps(x, y, yerr)
+    # cadence=None means the median time step.
+    if cadence is None:
+        cadence = np.median(np.diff(x))
+    x, y, yerr, i_new = fill_gaps(x, y, yerr, cadence=cadence)
 
     # Sampling and cutoff frequencies
     fs = 1./cadence
@@ -85,6 +214,6 @@ def bandpass_filter(x, y, yerr, pmin=0.5, pmax=100, cadence=1766./86400,
             yfilt[i_new] = 0
         return x, yfilt, yerr
     else:
-        return (np.delete(x, i_new), 
-                np.delete(yfilt, i_new), 
-                np.delete(yerr, i_new))
+        keep = np.ones(len(x), dtype=bool)
+        keep[i_new] = False
+        return x[keep], yfilt[keep], yerr[keep]
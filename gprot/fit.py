@@ -49,15 +49,177 @@ def write_samples(mod, df, resultsdir='results', true_period=None):
     fig.savefig(figfile)
     print('Corner plot saved to {}.'.format(figfile))
 
+def _moves(mixedmoves=True):
+    if mixedmoves:
+        return [(emcee3.moves.KDEMove(), 0.4),
+                (emcee3.moves.DEMove(1.0), 0.4),
+                (emcee3.moves.DESnookerMove(), 0.2)]
+    else:
+        return emcee3.moves.KDEMove()
+
+def resample_walkers(mod, coords, lnw, seed=None, jitter=1e-3):
+    """Resamples walkers according to log-weights lnw
+
+    Uses systematic resampling.  Duplicated walkers are jittered by a
+    small fraction of the ensemble spread, so that the ensemble moves do
+    not start from identical walkers (jittered points outside the prior
+    are left where they were).
+    """
+    rng = np.random.RandomState(seed)
+    nwalkers = len(coords)
+    lnw = np.where(np.isfinite(lnw), lnw, -np.inf)
+    if not np.isfinite(lnw).any():
+        return coords
+    w = np.exp(lnw - lnw.max())
+    cdf = np.cumsum(w / w.sum())
+    u = (rng.rand() + np.arange(nwalkers)) / nwalkers
+    inds = np.minimum(np.searchsorted(cdf, u), nwalkers - 1)
+
+    new = coords[inds].copy()
+    dup = np.concatenate(([False], inds[1:] == inds[:-1]))
+    scale = jitter * coords.std(axis=0)
+    for i in np.flatnonzero(dup):
+        trial = new[i] + scale * rng.randn(coords.shape[1])
+        if np.isfinite(mod.lnprior(trial)):
+            new[i] = trial
+    return new
+
+def effective_sample_size(lnw):
+    """Returns Kish effective sample size of log-weights lnw
+    """
+    lnw = np.where(np.isfinite(lnw), lnw, -np.inf)
+    if not np.isfinite(lnw).any():
+        return 0.
+    w = np.exp(lnw - lnw.max())
+    return w.sum()**2 / (w**2).sum()
+
+def _next_beta(dlnl, beta, target):
+    """Largest beta' <= 1 with ESS of (beta' - beta) * dlnl >= target
+    """
+    if effective_sample_size((1 - beta) * dlnl) >= target:
+        return 1.
+    lo, hi = 0., 1 - beta
+    for _ in range(30):
+        mid = (lo + hi) / 2
+        if effective_sample_size(mid * dlnl) >= target:
+            lo = mid
+        else:
+            hi = mid
+    return beta + lo
+
+class BridgeModel(object):
+    """Tempered bridge between coarse- and fine-data models
+
+    Log-likelihood is (1 - beta) * coarse.lnlike + beta * fine.lnlike,
+    with the prior of fine.
+    """
+    def __init__(self, coarse, fine, beta):
+        self.coarse = coarse
+        self.fine = fine
+        self.beta = beta
+
+    @property
+    def ndim(self):
+        return self.fine.ndim
+
+    def lnprior(self, theta):
+        return self.fine.lnprior(theta)
+
+    def lnlike(self, theta):
+        return ((1 - self.beta) * self.coarse.lnlike(theta) +
+                self.beta * self.fine.lnlike(theta))
+
+def anneal_emcee3(mod, coords, fidelity=(8, 2), nsteps=100, pool=None,
+                  mixedmoves=True, verbose=False, seed=None,
+                  ess_min=0.5, temper_steps=10, max_temper=10):
+    """Runs ensemble through coarse-to-fine versions of the data
+
+    For each binning factor in fidelity (coarsest first), the ensemble is
+    evolved for nsteps on `mod.lc.coarsened(nbin)` (each chunk binned by
+    nbin), which costs a fraction of a full-data step.
+
+    Each transition to finer data is tempered: walkers are
+    importance-resampled with weights exp(dbeta * (lnlike_fine -
+    lnlike_coarse)), with dbeta chosen so that the effective sample size
+    stays above ess_min * nwalkers, and then moved for temper_steps on
+    the bridge posterior at the new beta (see `BridgeModel`), until
+    beta = 1.  If that takes more than max_temper steps, or the weights
+    degenerate anyway, walkers are not resampled, and the chain just
+    continues on the finer data.
+
+    Returns coords of ensemble, ready to sample the full-data posterior.
+    """
+    if pool is None:
+        from emcee3.pools import DefaultPool
+        pool = DefaultPool()
+
+    if mod.acf_prior:
+        # Make sure the period prior comes from the full data.
+        mod.period_mixture
+
+    stages = []
+    for nbin in fidelity:
+        stage_mod = mod.with_lc(mod.lc.coarsened(nbin))
+        stages.append((nbin, stage_mod))
+    stages.append((1, mod))
+
+    def run(model, coords, n):
+        ensemble = emcee3.Ensemble(Emcee3Model(model), coords, pool=pool)
+        backend = Backend()
+        sampler = emcee3.Sampler(_moves(mixedmoves), backend=backend)
+        sampler.run(ensemble, n, progress=verbose)
+        return np.array(backend.current_coords)
+
+    rng = np.random.RandomState(seed)
+    nwalkers = len(coords)
+    for (nbin, stage_mod), (_, next_mod) in zip(stages[:-1], stages[1:]):
+        if verbose:
+            print('Sampling with data binned by {}...'.format(nbin))
+        coords = run(stage_mod, coords, nsteps)
+
+        beta = 0.
+        for i in range(max_temper):
+            dlnl = (np.array(list(pool.map(next_mod.lnlike, coords))) -
+                    np.array(list(pool.map(stage_mod.lnlike, coords))))
+            if i == max_temper - 1:
+                new_beta = 1.
+            else:
+                new_beta = _next_beta(dlnl, beta, ess_min * nwalkers)
+            lnw = (new_beta - beta) * dlnl
+            ess = effective_sample_size(lnw)
+            msg = ('Tempering from binning {}: beta = {:.3g}, '
+                   'ESS = {:.1f}/{}'.format(nbin, new_beta, ess, nwalkers))
+            logging.info(msg)
+            if verbose:
+                print(msg)
+            if ess < ess_min * nwalkers / 5.:
+                logging.warning('Weights degenerate (ESS = {:.1f}); '.format(ess) +
+                                'not resampling walkers.')
+                break
+            coords = resample_walkers(mod, coords, lnw,
+                                      seed=rng.randint(2**31))
+            beta = new_beta
+            if beta >= 1:
+                break
+            coords = run(BridgeModel(stage_mod, next_mod, beta), coords,
+                         temper_steps)
+    return coords
+
 def fit_emcee3(mod, nwalkers=500, verbose=False, nsamples=5000, targetn=6,
                 iter_chunksize=10, pool=None, overwrite=False,
                 maxiter=100, sample_directory='mcmc_chains',
-                nburn=3, mixedmoves=True, resultsdir='results', **kwargs):
+                nburn=3, mixedmoves=True, resultsdir='results',
+                fidelity=None, fidelity_steps=100, **kwargs):
     """fit model using Emcee3 
 
     modeled after https://github.com/dfm/gaia-kepler/blob/master/fit.py
 
     nburn is number of autocorr times to discard as burnin.
+
+    If fidelity is given (e.g., (8, 2)), a new ensemble is first run for
+    fidelity_steps on each coarser version of the data (see
+    `anneal_emcee3`), so burn-in mostly happens at a fraction of the
+    per-step cost.
     """
 
     # Initialize
@@ -72,20 +234,16 @@ def fit_emcee3(mod, nwalkers=500, verbose=False, nsamples=5000, targetn=6,
         backend = HDFBackend(sample_file)
         try:
             coords_init = backend.current_coords
+            resumed = True
         except (AttributeError, KeyError):
             coords_init = mod.sample_from_prior(nwalkers)
+            resumed = False
     else:
         backend = Backend()
         coords_init = mod.sample_from_prior(nwalkers)
+        resumed = False
 
-    if mixedmoves:
-        moves = [(emcee3.moves.KDEMove(), 0.4),
-                 (emcee3.moves.DEMove(1.0), 0.4),
-                 (emcee3.moves.DESnookerMove(), 0.2)]
-    else:
-        moves = emcee3.moves.KDEMove()
-
-    sampler = emcee3.Sampler(moves, backend=backend)
+    sampler = emcee3.Sampler(_moves(mixedmoves), backend=backend)
     if overwrite:
         sampler.reset()
         coords_init = mod.sample_from_prior(nwalkers)
@@ -94,6 +252,11 @@ def fit_emcee3(mod, nwalkers=500, verbose=False, nsamples=5000, targetn=6,
         from emcee3.pools import DefaultPool
         pool = DefaultPool()
 
+    if fidelity and (overwrite or not resumed):
+        coords_init = anneal_emcee3(mod, coords_init, fidelity=fidelity,
+                                    nsteps=fidelity_steps, pool=pool,
+                                    mixedmoves=mixedmoves, verbose=verbose)
+
     ensemble = emcee3.Ensemble(walker, coords_init, pool=pool)
 
     def calc_stats(s):
@@ -151,6 +314,226 @@ def fit_emcee3(mod, nwalkers=500, verbose=False, nsamples=5000, targetn=6,
     return df
     # return sampler
 
+class SubposteriorModel(object):
+    """Subposterior of a group of chunks, for consensus Monte Carlo
+
+    Likelihood is that of the chunks of mod.lc with indices in chunks,
+    and the prior is fractionated (raised to the power 1/nsub), so that
+    the product of the nsub subposteriors is the full posterior.
+    """
+    def __init__(self, mod, chunks, nsub):
+        self.mod = mod
+        self.chunks = chunks
+        self.nsub = nsub
+
+    @property
+    def ndim(self):
+        return self.mod.ndim
+
+    def lnprior(self, theta):
+        return self.mod.lnprior(theta) / self.nsub
+
+    def lnlike(self, theta):
+        mod, lc = self.mod, self.mod.lc
+        gps = mod.chunk_gps()
+        masks = getattr(lc, 'observed_list', None)
+        if masks is None:
+            masks = [None] * len(lc.x_list)
+        return np.sum([mod.lnlike_function(theta, lc.x_list[i], lc.y_list[i],
+                                           lc.yerr_list[i], mask=masks[i],
+                                           gp=gps[i])
+                       for i in self.chunks])
+
+def _sample_subposterior(args):
+    """Runs emcee3 ensemble on one subposterior; returns nsamples draws
+    """
+    submod, nwalkers, nsteps, nsamples, mixedmoves, seed = args
+    rng = np.random.RandomState(seed)
+    coords = submod.mod.sample_from_prior(nwalkers, seed=rng.randint(2**31))
+    ensemble = emcee3.Ensemble(Emcee3Model(submod), coords)
+    backend = Backend()
+    sampler = emcee3.Sampler(_moves(mixedmoves), backend=backend)
+    sampler.run(ensemble, nsteps)
+
+    # Discard first half as burn-in.
+    samples = sampler.get_coords(flat=True, discard=nsteps // 2)
+    inds = rng.choice(len(samples), size=nsamples,
+                      replace=nsamples > len(samples))
+    return samples[inds]
+
+def consensus_combine(subsamples):
+    """Combines equal-size subposterior samples by consensus weighting
+
+    Draw i of the combined sample is the weighted average of draws i of
+    the subposteriors, with weights their inverse sample covariances
+    (Scott et al. 2016).  Exact for Gaussian subposteriors; multimodal
+    (e.g., period-aliased) subposteriors are averaged across modes.
+    """
+    weights = [np.linalg.inv(np.atleast_2d(np.cov(s, rowvar=False)))
+               for s in subsamples]
+    total = np.linalg.inv(np.sum(weights, axis=0))
+    weighted = np.sum([np.dot(s, W) for s, W in zip(subsamples, weights)],
+                      axis=0)
+    return np.dot(weighted, total)
+
+def fit_consensus(mod, ngroups=4, nwalkers=100, nsteps=1000,
+                  nsamples=5000, pool=None, mixedmoves=True, verbose=False,
+                  resultsdir='results', seed=None, **kwargs):
+    """Fits model by consensus Monte Carlo over groups of chunks
+
+    Chunks of mod.lc are split into ngroups contiguous groups, and each
+    subposterior (see `SubposteriorModel`) is sampled independently by an
+    emcee3 ensemble of nwalkers for nsteps, in parallel over pool.  Few
+    groups are best: each subposterior should still be roughly Gaussian,
+    which the posteriors of single chunks usually are not.  nsamples
+    draws from each are then combined with `consensus_combine`; combined
+    draws outside the prior support are dropped, and the rest written
+    with `write_samples`.
+    """
+    if mod.lc.x_list is None:
+        raise ValueError('Consensus fitting needs a chunked light curve.')
+    nchunks = len(mod.lc.x_list)
+    if ngroups is None:
+        ngroups = nchunks
+    groups = np.array_split(np.arange(nchunks), min(ngroups, nchunks))
+
+    if mod.acf_prior:
+        # Make sure the period prior comes from the full data.
+        mod.period_mixture
+
+    rng = np.random.RandomState(seed)
+    tasks = [(SubposteriorModel(mod, g, len(groups)), nwalkers, nsteps,
+              nsamples, mixedmoves, rng.randint(2**31)) for g in groups]
+    if verbose:
+        print('Sampling {} subposteriors of {} chunks...'.format(len(groups),
+                                                                  nchunks))
+    if pool is None:
+        subsamples = list(map(_sample_subposterior, tasks))
+    else:
+        subsamples = list(pool.map(_sample_subposterior, tasks))
+
+    samples = consensus_combine(subsamples)
+    ok = np.array([np.isfinite(mod.lnprior(s)) for s in samples])
+    if not ok.all():
+        logging.warning('{}: dropping {} of {} '.format(mod.name, (~ok).sum(),
+                                                      len(ok)) +
+                        'combined samples outside the prior support.')
+    if not ok.any():
+        raise RuntimeError('No combined samples within the prior support.')
+    df = pd.DataFrame(samples[ok], columns=mod.param_names)
+    write_samples(mod, df, resultsdir=resultsdir)
+    return df
+
+def _minibatch_grad(mod, theta, batch, nchunks):
+    """Unbiased estimate of lnpost gradient from a minibatch of chunks
+    """
+    lc = mod.lc
+    gps = mod.chunk_gps()
+    masks = getattr(lc, 'observed_list', None)
+    if masks is None:
+        masks = [None] * nchunks
+    grad = np.zeros(len(theta))
+    for i in batch:
+        lnl, g = mod.lnlike_grad_function(theta, lc.x_list[i], lc.y_list[i],
+                                          lc.yerr_list[i], mask=masks[i],
+                                          gp=gps[i])
+        if not np.isfinite(lnl):
+            return None
+        grad += g
+    return mod.lnprior_grad(theta) + grad * nchunks / len(batch)
+
+def _sgld_chain(args):
+    """Runs one preconditioned SGLD chain; returns (nsteps, ndim) trace
+
+    At step t, the step size is step_size * (1 + t/100)**-decay, and the
+    diagonal preconditioner is an RMSprop average of squared gradients
+    (Li et al. 2016).  Proposals outside the prior support are rejected.
+    """
+    mod, theta, nsteps, batchsize, step_size, decay, seed = args
+    rng = np.random.RandomState(seed)
+    nchunks = len(mod.lc.x_list)
+    batchsize = min(batchsize, nchunks)
+
+    theta = np.array(theta, dtype=float)
+    V = None
+    trace = np.empty((nsteps, len(theta)))
+    for t in range(nsteps):
+        batch = rng.choice(nchunks, size=batchsize, replace=False)
+        grad = _minibatch_grad(mod, theta, batch, nchunks)
+        if grad is not None:
+            V = grad**2 if V is None else 0.99 * V + 0.01 * grad**2
+            precond = 1. / (1e-5 + np.sqrt(V))
+            eps = step_size * (1 + t / 100.)**(-decay)
+            trial = (theta + 0.5 * eps * precond * grad +
+                     np.sqrt(eps * precond) * rng.randn(len(theta)))
+            if np.isfinite(mod.lnprior(trial)):
+                theta = trial
+        trace[t] = theta
+    return trace
+
+def gelman_rubin(traces):
+    """Returns potential scale reduction factor of each parameter
+
+    traces is (nchains, nsteps, ndim).
+    """
+    traces = np.asarray(traces)
+    n = traces.shape[1]
+    W = traces.var(axis=1, ddof=1).mean(axis=0)
+    B = n * traces.mean(axis=1).var(axis=0, ddof=1)
+    return np.sqrt(((n - 1.) / n * W + B / n) / W)
+
+def fit_sgmcmc(mod, nchains=4, nsteps=2000, batchsize=4, step_size=0.2,
+               decay=0.55, ninit=100, nsamples=5000, pool=None,
+               verbose=False, resultsdir='results', seed=None, **kwargs):
+    """Fits model by stochastic-gradient Langevin dynamics on chunks
+
+    Each of nchains chains (run in parallel over pool) starts from the
+    best of ninit prior samples and takes nsteps preconditioned SGLD
+    steps (see `_sgld_chain`), each using the likelihood gradient of
+    batchsize randomly chosen chunks, scaled up to all chunks.  The first
+    half of each chain is discarded.  As diagnostics, the Gelman-Rubin
+    statistic across chains and the integrated autocorrelation time are
+    printed (if verbose); the kept samples are thinned by the latter
+    before nsamples are drawn and written with `write_samples`.
+    """
+    if mod.lc.x_list is None:
+        raise ValueError('Stochastic-gradient fitting needs a chunked light curve.')
+
+    if mod.acf_prior:
+        # Make sure the period prior comes from the full data.
+        mod.period_mixture
+
+    rng = np.random.RandomState(seed)
+    init = mod.sample_from_prior(ninit, seed=rng.randint(2**31))
+    lnpost = np.array([mod.lnpost(theta) for theta in init])
+    order = np.argsort(-np.where(np.isfinite(lnpost), lnpost, -np.inf))
+    starts = init[order[:nchains]]
+
+    tasks = [(mod, theta, nsteps, batchsize, step_size, decay,
+              rng.randint(2**31)) for theta in starts]
+    if pool is None:
+        traces = list(map(_sgld_chain, tasks))
+    else:
+        traces = list(pool.map(_sgld_chain, tasks))
+    traces = np.array(traces)[:, nsteps // 2:]
+
+    try:
+        tau = np.max([emcee3.autocorr.integrated_time(tr, c=1)
+                      for tr in traces])
+    except emcee3.autocorr.AutocorrError:
+        tau = 1.
+    thin = max(int(tau), 1)
+    if verbose:
+        print('Gelman-Rubin R: {}'.format(gelman_rubin(traces)))
+        print('Maximum autocorrelation time: {}'.format(tau))
+
+    samples = traces[:, ::thin].reshape((-1, mod.ndim))
+    ntot = min(nsamples, len(samples))
+    inds = rng.choice(len(samples), size=ntot, replace=False)
+    df = pd.DataFrame(samples[inds], columns=mod.param_names)
+    write_samples(mod, df, resultsdir=resultsdir)
+    return df
+
 def fit_mnest(mod, basename=None, test=False, 
                 verbose=False, resultsdir='results', overwrite=False, **kwargs):
     import pymultinest
@@ -1,23 +1,169 @@
 from __future__ import print_function, division
 
+import os
 import re
+import hashlib
+import tempfile
 import numpy as np
 import pandas as pd
 from time import sleep
 import logging
+import glob
+from multiprocessing.pool import ThreadPool
 
 from collections import OrderedDict
 
-import kplr
-from kplr.api import APIError
+try:
+    import kplr
+    from kplr.api import APIError
+except ImportError:
+    kplr = None
 
 
-from .lc import LightCurve, qtr_times
-from .model import GPRotModel
+from .lc import LightCurve, qtr_times, quarter_slices
+from .archive import open_archive
+from .model import GPRotModel, WhittleGPRotModel, StreamingGPRotModel
+from .binning import StreamingBinner
+from .koi import KOITable, get_koi_table
+from .config import LC_CACHE_DIR
 
 client = None
 offline_client = None
 
+# Bump this whenever the cleaning in KeplerLightCurve._read_data changes.
+LC_CACHE_VERSION = 1
+
+def good_columns(hdu_data, sap=False, rows=slice(None)):
+    """Returns good time, flux, flux_err from Kepler light curve table
+
+    Only the needed columns (and rows) of the FITS table are read.
+    Points with nonzero `sap_quality` or non-finite flux are dropped.
+    """
+    flux_col = 'sap_flux' if sap else 'pdcsap_flux'
+    t = hdu_data['time'][rows]
+    f = hdu_data[flux_col][rows]
+    f_e = hdu_data[flux_col + '_err'][rows]
+    q = hdu_data['sap_quality'][rows]
+
+    m = np.logical_not(q) & np.isfinite(f) & np.isfinite(f_e)
+    return (np.array(t[m], dtype=float), np.array(f[m], dtype=float),
+            np.array(f_e[m], dtype=float))
+
+def binned_columns(hdu_data, binsize, sap=False, blocksize=10000):
+    """Returns good time, flux, flux_err from table, binned to binsize
+
+    Rows are read and binned (with inverse-variance weights) blocksize
+    at a time, so the unbinned data are never all in memory.  Bins are
+    aligned to multiples of binsize in BKJD.
+    """
+    binner = StreamingBinner(binsize)
+    for i in range(0, len(hdu_data), blocksize):
+        t, f, f_e = good_columns(hdu_data, sap=sap,
+                                 rows=slice(i, i + blocksize))
+        binner.add(t, f, f_e)
+    return binner.result()
+
+def read_kepler_fits(filename, sap=False, binsize=None):
+    """Returns good time, flux, flux_err from Kepler-format FITS file
+
+    If binsize (days) is given, data are binned as they are read
+    (see `binned_columns`).
+    """
+    from astropy.io import fits
+    with fits.open(filename, memmap=True) as f:
+        if binsize is None:
+            return good_columns(f[1].data, sap=sap)
+        return binned_columns(f[1].data, binsize, sap=sap)
+
+def merge_quarters(pieces):
+    """Groups (time, flux, ferr) pieces (e.g., monthly files) by quarter
+
+    Returns list of (time, flux, ferr) per quarter, in time order.
+    """
+    pieces = [p for p in pieces if len(p[0]) > 0]
+    pieces.sort(key=lambda p: p[0][0])
+    tstarts = qtr_times['tstart'].values
+
+    merged = OrderedDict()
+    for t, f, f_e in pieces:
+        qtr = np.searchsorted(tstarts, t[0], side='right') - 1
+        merged.setdefault(qtr, []).append((t, f, f_e))
+    return [tuple(np.concatenate(cols) for cols in zip(*ps))
+            for ps in merged.values()]
+
+def transit_mask(time, periods, epochs, durations, width=0.55):
+    """Returns boolean mask of points within transits of any planet
+
+    A point is masked if it is within width * duration of a predicted
+    mid-transit time.  For each planet, whichever is cheaper is used:
+    predicted transit windows are located in the (sorted) times with
+    `searchsorted` and only those index ranges are marked, or (if there
+    are more transits than points) phases are computed for all points.
+
+    Parameters
+    ----------
+    time : array_like
+        Times (BKJD).
+
+    periods, epochs : array_like
+        Periods and mid-transit epochs (days, BKJD) of each planet.
+
+    durations : array_like
+        Transit durations (hours).
+
+    width : float
+        Half-width of masked window, in units of duration.
+    """
+    time = np.asarray(time)
+    N = len(time)
+    m = np.zeros(N, dtype=bool)
+    periods, epochs, durations = np.broadcast_arrays(np.atleast_1d(periods),
+                                                     np.atleast_1d(epochs),
+                                                     np.atleast_1d(durations))
+    if N == 0 or len(periods) == 0:
+        return m
+
+    halfwidth = durations / 24. * width
+    n_first = np.floor((time.min() - epochs) / periods - 0.5)
+    n_last = np.ceil((time.max() - epochs) / periods + 0.5)
+    counts = (n_last - n_first + 1).astype(int)
+    windowed = counts < N
+
+    # Planets with very many transits: phase-fold all points at once.
+    if (~windowed).any():
+        p = periods[~windowed, None]
+        phase = (time + p/2. - epochs[~windowed, None]) % p - p/2.
+        m |= (np.absolute(phase) < halfwidth[~windowed, None]).any(axis=0)
+
+    # Others: mark index ranges of all predicted transit windows.
+    if windowed.any():
+        k = np.repeat(np.flatnonzero(windowed), counts[windowed])
+        offsets = np.cumsum(counts[windowed]) - counts[windowed]
+        n = (n_first[k] + np.arange(len(k)) -
+             np.repeat(offsets, counts[windowed]))
+        centers = epochs[k] + n * periods[k]
+
+        order = None
+        if (np.diff(time) < 0).any():
+            order = np.argsort(time, kind='mergesort')
+            t = time[order]
+        else:
+            t = time
+
+        i0 = np.searchsorted(t, centers - halfwidth[k], side='right')
+        i1 = np.searchsorted(t, centers + halfwidth[k], side='left')
+        ok = i1 > i0
+        edges = np.zeros(N + 1, dtype=int)
+        np.add.at(edges, i0[ok], 1)
+        np.add.at(edges, i1[ok], -1)
+        in_transit = np.cumsum(edges[:-1]) > 0
+        if order is None:
+            m |= in_transit
+        else:
+            m[order] |= in_transit
+
+    return m
+
 class KeplerGPRotModel(GPRotModel):
     """Parameters are A, l, G, sigma, period
 
@@ -33,6 +179,16 @@ class KeplerGPRotModel(GPRotModel):
     _default_gp_prior_mu = (-13, 5.0, 1.9, -17)
     _default_gp_prior_sigma = (5.7, 1.2, 1.4, 5)
 
+class KeplerWhittleGPRotModel(WhittleGPRotModel, KeplerGPRotModel):
+    """WhittleGPRotModel with KeplerGPRotModel bounds and priors
+    """
+    pass
+
+class KeplerStreamingGPRotModel(StreamingGPRotModel, KeplerGPRotModel):
+    """StreamingGPRotModel with KeplerGPRotModel bounds and priors
+    """
+    pass
+
 
 class KeplerLightCurve(LightCurve):
     """
@@ -51,10 +207,53 @@ class KeplerLightCurve(LightCurve):
 
     chunksize : int
         (Approximate) number of points in each subchunk of the light curve.
+
+    memmap_dir : str, optional
+        If provided, keep full-resolution data in a memory-mapped
+        file in this directory (see `LightCurve`).
+
+    short_cadence : bool
+        Use short-cadence (1-minute) rather than long-cadence data.
+        Short-cadence data are binned to `bin_cadence` as they are read
+        from the FITS files, so the unbinned data are never all in memory.
+
+    bin_cadence : float
+        Bin size (days) for short-cadence data.  Bins are weighted by
+        inverse variance, and `yerr` is propagated.
+
+    cache : bool
+        Whether to read/write the cleaned, stitched light curve from/to
+        a local cache (in `cache_dir`), to avoid re-reading the FITS files.
+        Cache entries are keyed by star and by the `sap`, `normalized`,
+        `careful_stitching`, `quarters` and short-cadence options, and are invalidated
+        if any of the source files change.
+
+    cache_dir : str, optional
+        Cache directory.  Defaults to $GPROT_LC_CACHE, or ~/.gprot/lc_cache.
+
+    client : optional
+        kplr-like client to use instead of the shared `kplr.API`
+        (or `kplr.OfflineAPI`) instance, e.g. a local fake for testing
+        (see `gprot.fakekplr.FakeClient`).
+
+    koi_table : KOITable or str, optional
+        Local table of KOI parameters (or its filename), used for
+        KIC IDs and transit masking instead of per-KOI client lookups.
+        Defaults to $GPROT_KOI_TABLE (or ~/.gprot/koi_table.npy) if it
+        exists; KOIs not in the table are looked up with the client.
+
+    archive : str or LightCurveArchive, optional
+        Read the stitched light curve from this archive (see
+        `gprot.archive.build_kepler_archive`) instead of FITS files;
+        it is then sigma-clipped and subsampled as usual.
     """
+    chunk_quarters = True
+
     def __init__(self, kid, sub=1, nsigma=5, chunksize=200,
                  quarters=None, normalized=True, careful_stitching=False,
-                 sap=False, offline=False):
+                 sap=False, offline=False, memmap_dir=None,
+                 short_cadence=False, bin_cadence=0.01, cache=True,
+                 cache_dir=None, client=None, koi_table=None, archive=None):
 
         if kid < 10000:
             self.koinum = int(kid)
@@ -72,6 +271,11 @@ class KeplerLightCurve(LightCurve):
                 self.quarters = [quarters]
 
         self.offline = offline
+        self._client = client
+        if koi_table is None or isinstance(koi_table, KOITable):
+            self._koi_table = koi_table
+        else:
+            self._koi_table = get_koi_table(koi_table)
 
         self.sub = sub
         self.nsigma = nsigma
@@ -79,23 +283,35 @@ class KeplerLightCurve(LightCurve):
         self.normalized = normalized
         self.sap = sap        
         self.careful_stitching = careful_stitching
+        self.memmap_dir = memmap_dir
+        self.short_cadence = short_cadence
+        self.bin_cadence = bin_cadence
+        if short_cadence:
+            self.cadence = bin_cadence
+
+        self.archive = archive
 
-        self._x = None
-        self._y = None
-        self._yerr = None
+        self.cache = cache
+        if cache_dir is None:
+            cache_dir = LC_CACHE_DIR
+        self.cache_dir = cache_dir
+
+        self._full = None
+        self._data = None
+        self._mask = None
 
         self._x_list = None
         self._y_list = None
         self._yerr_list = None
 
-        self._x_full = None
-        self._y_full = None
-        self._yerr_full = None
-
     @property
     def client(self):
         global offline_client
         global client
+        if self._client is not None:
+            return self._client
+        if kplr is None:
+            raise ImportError('kplr is required to download Kepler data.')
         if self.offline:
             if offline_client is None:
                 offline_client = kplr.OfflineAPI()
@@ -105,6 +321,17 @@ class KeplerLightCurve(LightCurve):
                 client = kplr.API()
             return client
 
+    @property
+    def koi_table(self):
+        if self._koi_table is None:
+            self._koi_table = get_koi_table()
+        return self._koi_table
+
+    @property
+    def in_koi_table(self):
+        return (self.is_koi and self.koi_table is not None and
+                self.koi_table.has_koi(self.koinum))
+
     @property
     def is_koi(self):
         return self.koinum is not None
@@ -131,111 +358,261 @@ class KeplerLightCurve(LightCurve):
     @property
     def kepid(self):
         if self._kepid is None:
-            koi = self.client.koi(self.koinum + 0.01)
-            self._kepid = koi.kepid
+            if self.in_koi_table:
+                self._kepid = self.koi_table.kepid(self.koinum)
+            else:
+                koi = self.client.koi(self.koinum + 0.01)
+                self._kepid = koi.kepid
         return self._kepid            
 
-    def _get_data(self, clobber=False):
-        # Query kplr API to get KOI/KIC info.
+    @property
+    def _cache_opts(self):
+        opts = (LC_CACHE_VERSION, self.sap, self.normalized,
+                self.careful_stitching, self.quarters)
+        if self.short_cadence:
+            opts += ('slc', self.bin_cadence)
+        return opts
+
+    @property
+    def _fits_suffix(self):
+        return '_slc.fits' if self.short_cadence else '_llc.fits'
+
+    @property
+    def cache_filename(self):
+        """Cache file for the current star and data-cleaning options
+        """
         if self.is_koi:
-            star = self.client.koi(self.koinum + 0.01)                
-            kois = [self.client.koi(self.koinum + 0.01*i) for i in range(1, star.koi_count+1)]
+            star = 'KOI-{}'.format(self.koinum)
+        else:
+            star = 'KIC-{}'.format(self.kepid)
+        opts = repr(self._cache_opts).encode('utf-8')
+        key = hashlib.md5(opts).hexdigest()[:12]
+        return os.path.join(self.cache_dir, '{}_{}.npz'.format(star, key))
+
+    def _read_cache(self):
+        """Returns cached (time, flux, ferr), or None if missing/stale
+        """
+        filename = self.cache_filename
+        if not os.path.exists(filename):
+            return None
+        try:
+            with np.load(filename) as d:
+                if int(d['version']) != LC_CACHE_VERSION:
+                    return None
+                sources = [str(path) for path in d['sources']]
+                # New files (e.g., a newly downloaded quarter) invalidate
+                # the cache, as do changed ones.
+                if set(self._current_sources(sources)) != set(sources):
+                    return None
+                for path, size, mtime in zip(sources, d['sizes'],
+                                             d['mtimes']):
+                    st = os.stat(path)
+                    if st.st_size != size or st.st_mtime != mtime:
+                        return None
+                return d['time'], d['flux'], d['ferr']
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+    def _current_sources(self, sources):
+        """Returns light curve files now available for the cached sources
+
+        Looks for files of the same star and cadence in the directories
+        of the (previously recorded) sources.
+        """
+        current = set()
+        for path in sources:
+            kepids = re.findall(r'kplr(\d{9})', os.path.basename(path))
+            if not kepids:
+                current.add(path)
+                continue
+            pattern = 'kplr{}-*{}'.format(kepids[0], self._fits_suffix)
+            current.update(glob.glob(os.path.join(os.path.dirname(path),
+                                                  pattern)))
+        return sorted(current)
+
+    def _write_cache(self, time, flux, ferr, sources):
+        """Writes cache file; failures are logged, not raised
+        """
+        tmpname = None
+        try:
+            if not os.path.exists(self.cache_dir):
+                try:
+                    os.makedirs(self.cache_dir)
+                except OSError:
+                    # May have been created by another process.
+                    pass
+            stats = [os.stat(path) for path in sources]
+
+            # Write to temporary file first, so readers never see
+            # partial files.
+            fd, tmpname = tempfile.mkstemp(suffix='.npz', dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, time=time, flux=flux, ferr=ferr,
+                                    version=LC_CACHE_VERSION,
+                                    sources=np.array(sources),
+                                    sizes=np.array([st.st_size for st in stats]),
+                                    mtimes=np.array([st.st_mtime for st in stats]))
+            os.rename(tmpname, self.cache_filename)
+        except (IOError, OSError) as e:
+            logging.warning('Could not write light curve cache for ' +
+                            '{}: {}'.format(self.name, e))
+            if tmpname is not None and os.path.exists(tmpname):
+                try:
+                    os.remove(tmpname)
+                except OSError:
+                    pass
+
+    def _get_data(self, clobber=False):
+        data = None
+        if self.archive is not None:
+            data = self._read_archive()
+        elif self.cache and not clobber:
+            data = self._read_cache()
+        if data is None:
+            time, flux, ferr, sources = self._read_data(clobber=clobber)
+            if self.cache:
+                self._write_cache(time, flux, ferr, sources)
+        else:
+            time, flux, ferr = data
+
+        self._set_data(time, flux, ferr)
+
+        self.sigma_clip(self.nsigma)
+        self.subsample(self.sub)
+
+    def _read_archive(self):
+        """Returns (time, flux, ferr) from light curve archive
+
+        Archived light curves are already stitched (see
+        `gprot.archive.build_kepler_archive`), under the KOI or KIC
+        number they were given by; only `quarters` are selected here.
+        """
+        kid = self.koinum if self.is_koi else self._kepid
+        time, flux, ferr = open_archive(self.archive)[kid]
+        if self.quarters is not None:
+            index = quarter_slices(time, self.quarters)
+            sl = list(index.values())
+            time, flux, ferr = [np.concatenate([a[s] for s in sl])
+                                for a in (time, flux, ferr)]
+        return time, flux, ferr
+
+    def _read_data(self, clobber=False):
+        """Reads, cleans and stitches data from FITS files
+
+        Returns time, flux, ferr, and list of source filenames.
+        """
+        # Get KOI parameters from local table if possible,
+        # otherwise query kplr API.
+        if self.in_koi_table:
+            star = self.client.star(self.kepid)
+            kois = self.koi_table.planets(koinum=self.koinum)
+        elif self.is_koi:
+            star = self.client.koi(self.koinum + 0.01)
+            kois = self._client_kois(star)
         else:
             star = self.client.star(self.kepid)
             kois = []
 
         # Get a list of light curve datasets.
-        lcs = star.get_light_curves(short_cadence=False, clobber=clobber)
+        lcs = star.get_light_curves(short_cadence=self.short_cadence,
+                                    clobber=clobber)
+        if self.short_cadence:
+            lcs = [lc for lc in lcs if lc.filename.endswith(self._fits_suffix)]
 
-        # Loop over the datasets and read in the data.
-        time, flux, ferr = [], [], []
-        p_last = None
-        t_last = None
+        quarters = []
         for lc in lcs:
             with lc.open() as f:
                 # The lightcurve data are in the first FITS HDU.
-                hdu_data = f[1].data
-                t = hdu_data["time"]
-
-                if self.sap:
-                    f = hdu_data['sap_flux']
-                    f_e = hdu_data['sap_flux_err']
+                if self.short_cadence:
+                    quarters.append(binned_columns(f[1].data, self.bin_cadence,
+                                                   sap=self.sap))
                 else:
-                    f = hdu_data["pdcsap_flux"]
-                    f_e = hdu_data["pdcsap_flux_err"]
-                q = hdu_data["sap_quality"]
-
-                # Keep only good points, median-normalize and mean-subtract flux
-                m = np.logical_not(q) & np.isfinite(f) & np.isfinite(f_e)
-
-                if self.quarters is not None:
-                    ok = False
-                    for qtr in self.quarters:
-                        t0, t1 = qtr_times.ix[qtr, ['tstart', 'tstop']]
-                        # print(qtr, t0, t1, t[m].min(), t[m].max())
-                        if (np.absolute(t0 - t[m].min()) < 10 and
-                            np.absolute(t1 - t[m].max()) < 10):
-                            ok = True
-                    if not ok:
-                        continue
-
-                time.append(t[m])
-                if self.normalized:
-                    norm = np.median(f[m])
-                    flux.append(f[m] / norm - 1)
-                    ferr.append(f_e[m] / norm)
-                else:
-                    flux.append(f[m])
-                    ferr.append(f_e[m])
-
-                if self.careful_stitching:
-                    if not self.sap:
-                        raise NotImplementedError('Do not use "careful_stitching" option if not using SAP data.')
-                    # Use polynomial fit from last quarter to set level.
-                    if p_last is not None:
-                        t0 = time[-1][0]
-
-                        # If a quarter is missing, don't try to fit polynomial.
-                        if t0 - t_last > 20:
-                            f_initial = flux[-2][-1]
-                        else:
-                            f_initial = np.polyval(p_last, t0)
-                        f_offset = f_initial - flux[-1][0]
-                        flux[-1] += f_offset
-
-                    # Fit 3rd-degree polynomial to tail of quarter to 
-                    # set initial level for next quarter
-                    p_last = np.polyfit(time[-1], flux[-1], 3)
-                    t_last = time[-1][-1]
+                    quarters.append(good_columns(f[1].data, sap=self.sap))
+
+        if self.short_cadence:
+            # Short-cadence data come in monthly files.
+            quarters = merge_quarters(quarters)
+
+        time, flux, ferr = self._stitch(quarters, kois)
+        sources = [lc.filename for lc in lcs]
+        return time, flux, ferr, sources
+
+    def _client_kois(self, star):
+        """Returns KOITable rows of all KOIs of star, looked up with client
+        """
+        return KOITable.from_kois([self.client.koi(self.koinum + 0.01*i)
+                                   for i in range(1, star.koi_count+1)]).data
+
+    def _stitch(self, quarters, kois):
+        """Normalizes, stitches and masks good (time, flux, ferr) per quarter
+
+        Only quarters in `self.quarters` (if set) are kept, and transits
+        of kois (rows of a `KOITable`) are masked.
+        """
+        if self.quarters is not None:
+            tstarts = qtr_times.loc[self.quarters, 'tstart'].values
+            tstops = qtr_times.loc[self.quarters, 'tstop'].values
+
+        time, flux, ferr = [], [], []
+        p_last = None
+        t_last = None
+        for t, f, f_e in quarters:
+            if len(t) == 0:
+                continue
+
+            if self.quarters is not None:
+                ok = ((np.absolute(tstarts - t[0]) < 10) &
+                      (np.absolute(tstops - t[-1]) < 10))
+                if not ok.any():
+                    continue
+
+            # Median-normalize and mean-subtract flux
+            time.append(t)
+            if self.normalized:
+                norm = np.median(f)
+                flux.append(f / norm - 1)
+                ferr.append(f_e / norm)
+            else:
+                flux.append(f)
+                ferr.append(f_e)
+
+            if self.careful_stitching:
+                if not self.sap:
+                    raise NotImplementedError('Do not use "careful_stitching" option if not using SAP data.')
+                # Use polynomial fit from last quarter to set level.
+                if p_last is not None:
+                    t0 = time[-1][0]
+
+                    # If a quarter is missing, don't try to fit polynomial.
+                    if t0 - t_last > 20:
+                        f_initial = flux[-2][-1]
+                    else:
+                        f_initial = np.polyval(p_last, t0)
+                    f_offset = f_initial - flux[-1][0]
+                    flux[-1] += f_offset
+
+                # Fit 3rd-degree polynomial to tail of quarter to 
+                # set initial level for next quarter
+                p_last = np.polyfit(time[-1], flux[-1], 3)
+                t_last = time[-1][-1]
 
         time = np.concatenate(time)
         flux = np.concatenate(flux)
         ferr = np.concatenate(ferr)
 
         # Mask transits for all kois 
-        m = np.zeros(len(time), dtype=bool)
-        for k in kois:
-            period, epoch = k.koi_period, k.koi_time0bk
-            phase = (time + period/2. - epoch) % period - (period/2)
-            duration = k.koi_duration / 24.
-            m |= np.absolute(phase) < duration*0.55
+        if len(kois) > 0:
+            m = transit_mask(time, kois['koi_period'], kois['koi_time0bk'],
+                             kois['koi_duration'])
+        else:
+            m = np.zeros(len(time), dtype=bool)
 
         # Mask times > 1581 to avoid penultimate safe mode
         # Also, require to be at least > Q2
         if self.quarters is None:
-            m |= time > 1581
-            m |= time < 260
-
-        self._x = time[~m]
-        self._y = flux[~m]
-        self._yerr = ferr[~m]
+            m |= (time > 1581) | (time < 260)
 
-        self._x_full = time[~m].copy()
-        self._y_full = flux[~m].copy()
-        self._yerr_full = ferr[~m].copy()
-
-        self.sigma_clip(self.nsigma)
-        self.subsample(self.sub)
+        return time[~m], flux[~m], ferr[~m]
 
     # def multi_split_quarters(self):
     #     if self.quarters is None:
@@ -265,3 +642,105 @@ class KeplerLightCurve(LightCurve):
     # def _make_chunks(self, *args, **kwargs):
     #     self._split_quarters()
 
+
+
+class FitsDirectoryLightCurve(KeplerLightCurve):
+    """
+    Kepler light curve from a local directory of FITS files, without kplr
+
+    Files must be in the Kepler light curve format (`time`,
+    `pdcsap_flux`, `sap_quality` columns, e.g. a mirror of MAST).
+    Quarters are decoded concurrently in a pool of threads, reading
+    only the needed columns, and are then cleaned, normalized and
+    stitched exactly as in `KeplerLightCurve`.
+
+    Parameters
+    ----------
+    path : str
+        Directory of FITS files (searched recursively).
+
+    kid : int, optional
+        KOI or KIC number.  If given, only files named as on MAST
+        (`kplr{kepid:09d}-*_llc.fits`, or `*_slc.fits` with
+        `short_cadence=True`) are read; a KOI number needs
+        `koi_table` (or a client) to find its KIC ID.  If not given,
+        all light curve files in `path` must belong to one star, whose
+        KIC ID is taken from the file names.
+
+    threads : int
+        Number of threads used to read files.
+
+    Other keyword arguments are passed to `KeplerLightCurve`.
+    """
+    def __init__(self, path, kid=None, threads=4, **kwargs):
+        self.path = path
+        self.threads = threads
+        self._filenames = None
+
+        if kid is None:
+            suffix = '_slc.fits' if kwargs.get('short_cadence') else '_llc.fits'
+            filenames = self._find_files('*' + suffix)
+            kepids = set()
+            for f in filenames:
+                kepids.update(re.findall(r'kplr(\d{9})', os.path.basename(f)))
+            if len(kepids) != 1:
+                raise ValueError('Cannot identify star from FITS file names ' +
+                                 'in {}; please provide kid.'.format(path))
+            kid = int(kepids.pop())
+            self._filenames = filenames
+
+        super(FitsDirectoryLightCurve, self).__init__(kid, **kwargs)
+
+    def _find_files(self, pattern):
+        filenames = []
+        for root, dirs, files in os.walk(self.path):
+            filenames += glob.glob(os.path.join(root, pattern))
+        return sorted(filenames)
+
+    @property
+    def filenames(self):
+        if self._filenames is None:
+            pattern = 'kplr{:09d}-*{}'.format(self.kepid, self._fits_suffix)
+            self._filenames = self._find_files(pattern)
+        return self._filenames
+
+    @property
+    def _cache_opts(self):
+        opts = super(FitsDirectoryLightCurve, self)._cache_opts
+        return opts + (os.path.abspath(self.path),)
+
+    def _read_data(self, clobber=False):
+        filenames = self.filenames
+        if len(filenames) == 0:
+            raise IOError('No FITS files for {} in {}.'.format(self.name,
+                                                               self.path))
+
+        if self.in_koi_table:
+            kois = self.koi_table.planets(koinum=self.koinum)
+        elif self.is_koi:
+            kois = self._client_kois(self.client.koi(self.koinum + 0.01))
+        else:
+            kois = []
+
+        binsize = self.bin_cadence if self.short_cadence else None
+        def read(filename):
+            return read_kepler_fits(filename, sap=self.sap, binsize=binsize)
+
+        if self.threads > 1 and len(filenames) > 1:
+            pool = ThreadPool(min(self.threads, len(filenames)))
+            try:
+                quarters = pool.map(read, filenames)
+            finally:
+                pool.close()
+        else:
+            quarters = [read(f) for f in filenames]
+
+        # Stitch in time order, whatever the file names.
+        quarters = merge_quarters(quarters)
+
+        time, flux, ferr = self._stitch(quarters, kois)
+        return time, flux, ferr, filenames
+
+    def _current_sources(self, sources):
+        pattern = 'kplr{:09d}-*{}'.format(self.kepid, self._fits_suffix)
+        return self._find_files(pattern)
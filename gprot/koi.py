@@ -0,0 +1,131 @@
+from __future__ import print_function, division
+
+import os
+import re
+import numpy as np
+import pandas as pd
+
+from .config import KOI_TABLE
+
+KOI_DTYPE = [('koi', '<f8'), ('koinum', '<i8'), ('kepid', '<i8'),
+             ('koi_period', '<f8'), ('koi_time0bk', '<f8'),
+             ('koi_duration', '<f8')]
+
+_koi_tables = {}
+
+def _koi_from_name(name):
+    """Returns KOI number (e.g. 42.01) from kepoi_name (e.g. 'K00042.01')
+    """
+    return float(re.sub('^K0*', '', name.strip()))
+
+class KOITable(object):
+    """Local columnar table of KOI transit parameters
+
+    Holds KOI number, KIC ID, period, epoch (BKJD) and duration (hours)
+    for every planet candidate, indexed in memory by KOI number (integer
+    part, i.e., by star) and by KIC ID, so that transit masks need no
+    kplr API calls.
+
+    Parameters
+    ----------
+    data : array_like
+        Structured array with fields of `KOI_DTYPE`.
+    """
+    def __init__(self, data):
+        self.data = np.array(data, dtype=KOI_DTYPE)
+        self._by_koinum = self._make_index('koinum')
+        self._by_kepid = self._make_index('kepid')
+
+    def _make_index(self, field):
+        index = {}
+        for i, key in enumerate(self.data[field]):
+            index.setdefault(int(key), []).append(i)
+        return dict((k, np.array(v)) for k, v in index.items())
+
+    def __len__(self):
+        return len(self.data)
+
+    def has_koi(self, koinum):
+        return int(koinum) in self._by_koinum
+
+    def has_kepid(self, kepid):
+        return int(kepid) in self._by_kepid
+
+    def kepid(self, koinum):
+        """Returns KIC ID of the host of KOI koinum
+        """
+        return int(self.data['kepid'][self._by_koinum[int(koinum)][0]])
+
+    def planets(self, koinum=None, kepid=None):
+        """Returns table rows of all KOIs of a star, by KOI number or KIC ID
+        """
+        if koinum is not None:
+            inds = self._by_koinum.get(int(koinum), [])
+        else:
+            inds = self._by_kepid.get(int(kepid), [])
+        return self.data[np.sort(inds).astype(int)]
+
+    def write(self, filename):
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        np.save(filename, self.data)
+
+    @classmethod
+    def read(cls, filename):
+        return cls(np.load(filename))
+
+    @classmethod
+    def from_rows(cls, kois, kepids, periods, epochs, durations):
+        kois = np.asarray(kois, dtype=float)
+        data = np.empty(len(kois), dtype=KOI_DTYPE)
+        data['koi'] = kois
+        data['koinum'] = np.floor(kois + 1e-6).astype(int)
+        data['kepid'] = kepids
+        data['koi_period'] = periods
+        data['koi_time0bk'] = epochs
+        data['koi_duration'] = durations
+        return cls(data)
+
+    @classmethod
+    def from_csv(cls, filename, **kwargs):
+        """Builds table from NASA Exoplanet Archive KOI table (CSV)
+
+        Needs columns kepid, kepoi_name (or koi), koi_period, koi_time0bk
+        and koi_duration.  Keyword arguments go to `pandas.read_csv`.
+        """
+        kwargs.setdefault('comment', '#')
+        df = pd.read_csv(filename, **kwargs)
+        df = df.dropna(subset=['koi_period', 'koi_time0bk', 'koi_duration'])
+        if 'koi' in df.columns:
+            kois = df['koi'].values
+        else:
+            kois = [_koi_from_name(n) for n in df['kepoi_name']]
+        return cls.from_rows(kois, df['kepid'].values,
+                             df['koi_period'].values,
+                             df['koi_time0bk'].values,
+                             df['koi_duration'].values)
+
+    @classmethod
+    def from_kois(cls, kois):
+        """Builds table from kplr KOI objects (e.g., `client.kois()`)
+        """
+        kois = list(kois)
+        return cls.from_rows([_koi_from_name(k.kepoi_name) for k in kois],
+                             [k.kepid for k in kois],
+                             [k.koi_period for k in kois],
+                             [k.koi_time0bk for k in kois],
+                             [k.koi_duration for k in kois])
+
+def get_koi_table(filename=None):
+    """Returns shared KOITable read from filename, or None if not there
+
+    Default filename is $GPROT_KOI_TABLE, or ~/.gprot/koi_table.npy.
+    """
+    if filename is None:
+        filename = KOI_TABLE
+    if filename not in _koi_tables:
+        if not os.path.exists(filename):
+            return None
+        _koi_tables[filename] = KOITable.read(filename)
+    return _koi_tables[filename]
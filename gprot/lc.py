@@ -1,5 +1,9 @@
 from __future__ import print_function, division
 
+import os
+import tempfile
+import logging
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -13,33 +17,268 @@ from scipy.optimize import minimize
 from collections import OrderedDict
 from pkg_resources import resource_filename
 
-from .filter import sigma_clip, bandpass_filter
+from .filter import sigma_clip_mask, bandpass_filter, RollingPolyVariance
+from .filter import fill_gaps
+from .archive import open_archive
+from .structure import get_structure, times_key
+from .binning import bin_weighted
 from .plots import tableau20
 from .acf import acf, peakdetect
 
 qtr_times = pd.read_table(resource_filename('gprot', 'data/qStartStop.txt'), 
                           delim_whitespace=True, index_col=0)
 
-class LightCurve(object):
-    def __init__(self, x, y, yerr, name=None, chunksize=200, sub=None):
-        self._x = x.copy()
-        self._y = y.copy()
-        self._yerr = yerr.copy()
+def quarter_slices(x, quarters=None):
+    """Returns OrderedDict of quarter -> slice into sorted times x
+
+    Only quarters that contain data (and are in quarters, if provided)
+    are included.
+    """
+    starts = np.searchsorted(x, qtr_times['tstart'].values, side='left')
+    stops = np.searchsorted(x, qtr_times['tstop'].values, side='right')
+
+    index = OrderedDict()
+    for qtr, i0, i1 in zip(qtr_times.index, starts, stops):
+        if quarters is not None and qtr not in quarters:
+            continue
+        if i1 > i0:
+            index[qtr] = slice(i0, i1)
+    return index
 
+class LightCurve(object):
+    """Light curve with full-resolution and working (clipped/subsampled) data
+
+    The full-resolution x, y, yerr are stored as the rows of a single
+    read-only (3, N) buffer, and the working data as rows of a (3, n)
+    buffer, which is the full buffer itself until points are removed.
+    x, y, yerr (and x_full etc.) are views of these rows, and the chunks
+    in x_list etc. are views of the working buffer.  Assign to x, y or yerr
+    (rather than modifying them in place) to change working data.
+
+    If memmap_dir is given, the full-resolution buffer is written to a
+    temporary .npy file in that directory and memory-mapped, and is only
+    read into memory while acf, best_sublc or bandpass_filter run.  A
+    pickled memory-mapped LightCurve (e.g., sent to a sampling worker)
+    carries the file name instead of the full data, and the working data
+    as indices into it (if they are a selection of it).
+    """
+    _full = None
+    _data = None
+    _mask = None
+    # Indices of working points in _full, if working data are a selection
+    # of it (else None).
+    _full_index = None
+    _rolling = None
+    _qtr_index = None
+    # acf_prot results (which depend only on the full data), by arguments.
+    _acf_cache = None
+
+    # Chunking options (see `_make_chunks`).
+    adaptive_chunks = False
+    chunk_maxgap = None
+    chunk_maxspan = None
+    chunk_quarters = False
+    _chunk_options = ('adaptive_chunks', 'chunk_maxgap', 'chunk_maxspan',
+                      'chunk_quarters')
+
+    # (chunk list, masks of observed points) set by uniform_chunks.
+    _observed = None
+
+    # Binning of working data (see `bin`), reapplied by bandpass_filter.
+    nbin = None
+    bin_maxgap = None
+
+    # Time step of the data (days), used for filtering; if None, the
+    # median time step.
+    cadence = None
+
+    memmap_dir = None
+    _memmap_file = None
+    _memmap_pid = None
+    _archive_key = None
+
+    def __init__(self, x, y, yerr, name=None, chunksize=200, sub=None,
+                 memmap_dir=None):
         self.chunksize = chunksize
 
         self._name = name
 
+        self.memmap_dir = memmap_dir
+        self._set_data(x, y, yerr)
+
+        self.sub = sub
+        self.subsample(sub)
+
+    @classmethod
+    def from_archive(cls, star_id, archive=None, name=None, chunksize=200,
+                     sub=None):
+        """Returns LightCurve backed by a view of archived data
+
+        archive is a path (default $GPROT_ARCHIVE) or `LightCurveArchive`.
+        No data are copied or parsed until points are removed from the
+        working data.  Data are used as archived, without the cleaning of
+        `AigrainLightCurve` or `KeplerLightCurve` (which take an archive
+        argument for that).
+        """
+        archive = open_archive(archive)
+
+        lc = cls.__new__(cls)
+        lc.chunksize = chunksize
+        if name is None:
+            name = str(star_id)
+        lc._name = name
+        lc._set_buffer(archive[star_id])
+        lc._archive_key = (archive.path, star_id)
+
+        lc.sub = sub
+        lc.subsample(sub)
+        return lc
+
+    def _set_data(self, x, y, yerr):
+        """Replaces full-resolution data and resets working data to it
+        """
+        full = np.array((x, y, yerr), dtype=float)
+        if self.memmap_dir is None:
+            full.flags.writeable = False
+        else:
+            full = self._write_memmap(full)
+        self._set_buffer(full)
+
+    def _set_buffer(self, full):
+        """Uses (read-only) (3, N) array as full-resolution data, uncopied
+        """
+        self._archive_key = None
+        self._full = full
+        self._data = self._full
+        self._full_index = np.arange(full.shape[1])
+        self._mask = None
+
+        self._rolling = None
+        self._qtr_index = None
+        self._acf_cache = None
+
         self._x_list = None
         self._y_list = None
         self._yerr_list = None
 
-        self._x_full = x.copy()
-        self._y_full = y.copy()
-        self._yerr_full = yerr.copy()
+    def _write_memmap(self, data):
+        self._remove_memmap()
+        fd, filename = tempfile.mkstemp(prefix='gprot-', suffix='.npy',
+                                        dir=self.memmap_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, data)
+        self._memmap_file = filename
+        self._memmap_pid = os.getpid()
+        return np.load(filename, mmap_mode='r')
+
+    def _remove_memmap(self):
+        # Only the process that wrote the file removes it.
+        if self._memmap_file is not None and self._memmap_pid == os.getpid():
+            try:
+                os.remove(self._memmap_file)
+            except OSError:
+                pass
+        self._memmap_file = None
+
+    def __del__(self):
+        self._remove_memmap()
 
-        self.sub = sub
-        self.subsample(sub)
+    def _chunk_slices(self):
+        """Returns (i0, i1) of each chunk in working data, if all are views
+
+        None if any chunk is not a contiguous slice of the working arrays.
+        """
+        data = self._data
+        if self._x_list is None:
+            return None
+        start = data.__array_interface__['data'][0]
+        rowstride, step = data.strides
+        slices = []
+        for chunks in zip(self._x_list, self._y_list, self._yerr_list):
+            bounds = set()
+            for row, c in enumerate(chunks):
+                offset = c.__array_interface__['data'][0] - start
+                i0, rem = divmod(offset - row * rowstride, step)
+                if (rem or c.base is None or c.dtype != data.dtype or
+                        c.ndim != 1 or (len(c) > 1 and c.strides[0] != step) or
+                        i0 < 0 or i0 + len(c) > data.shape[1]):
+                    return None
+                bounds.add((i0, i0 + len(c)))
+            if len(bounds) > 1:
+                return None
+            slices.append(bounds.pop())
+        return slices
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_rolling'] = None
+        if self._memmap_file is not None or self._archive_key is not None:
+            state['_full'] = None
+            if self._data is self._full:
+                state['_data'] = None
+                state['_full_index'] = None
+            elif self._full_index is not None and self._data is not None:
+                # Send indices (and chunk bounds) instead of working data,
+                # which are rebuilt from the full data on unpickling.
+                slices = self._chunk_slices()
+                if slices is not None or self._x_list is None:
+                    state['_data'] = None
+                    state['_chunk_bounds_pickled'] = slices
+                    state['_x_list'] = None
+                    state['_y_list'] = None
+                    state['_yerr_list'] = None
+                    if (self._observed is not None and
+                            self._observed[0] is self._x_list):
+                        state['_observed'] = (None, self._observed[1])
+            state['_memmap_pid'] = None
+        return state
+
+    def __setstate__(self, state):
+        slices = state.pop('_chunk_bounds_pickled', None)
+        self.__dict__.update(state)
+        if self._memmap_file is not None:
+            self._full = np.load(self._memmap_file, mmap_mode='r')
+        elif self._archive_key is not None:
+            path, star_id = self._archive_key
+            self._full = open_archive(path)[star_id]
+        if self._full is not None and self._data is None:
+            if self._full_index is None:
+                self._data = self._full
+            else:
+                self._data = np.array(self._full[:, self._full_index])
+        if slices is not None:
+            chunks = [self._data[:, i0:i1] for i0, i1 in slices]
+            self._x_list = [c[0] for c in chunks]
+            self._y_list = [c[1] for c in chunks]
+            self._yerr_list = [c[2] for c in chunks]
+            if self._observed is not None and self._observed[0] is None:
+                self._observed = (self._x_list, self._observed[1])
+
+    def _full_arrays(self):
+        """Returns full-resolution data as in-memory (3, N) array
+
+        For memory-mapped data, this is a fresh copy read from disk, which
+        is freed again when the caller is done with it.
+        """
+        if self._full is None:
+            self._get_data()
+        if isinstance(self._full, np.memmap):
+            return np.array(self._full)
+        return self._full
+
+    def _set_working(self, data, full_index=None):
+        """Replaces working data with (3, n) array
+
+        full_index gives the indices of the new working points in the
+        full-resolution data, if they are a selection of it.
+        """
+        self._data = data
+        self._full_index = full_index
+        self._mask = None
+
+        self._x_list = None
+        self._y_list = None
+        self._yerr_list = None
 
     @property
     def name(self):
@@ -62,45 +301,25 @@ class LightCurve(object):
         Replaces lightcurve data with new filtered, edge-cropped data.
         """
         if cadence is None:
-            try:
-                cadence = self.cadence
-            except AttributeError:
-                pass
-
-        x, y, yerr = bandpass_filter(self._x_full,
-                                     self._y_full,
-                                     self._yerr_full, zero_fill=zero_fill,
-                                     pmin=pmin, pmax=pmax)
-        x = x[edge:-edge]
-        y = y[edge:-edge]
-        yerr = yerr[edge:-edge]
+            cadence = self.cadence
 
-        self._x = x.copy()
-        self._y = y.copy()
-        self._yerr = yerr.copy()
+        x, y, yerr = bandpass_filter(*self._full_arrays(), zero_fill=zero_fill,
+                                     pmin=pmin, pmax=pmax, cadence=cadence)
 
-        self._x_full = x.copy()
-        self._y_full = y.copy()
-        self._yerr_full = yerr.copy()
-
-        self._x_list = None
-        self._y_list = None
-        self._yerr_list = None
+        self._set_data(x[edge:-edge], y[edge:-edge], yerr[edge:-edge])
 
         if self.sub is not None:
             self.subsample(self.sub)
+        if self.nbin is not None:
+            self.bin(self.nbin, maxgap=self.bin_maxgap)
 
     def acf(self, pmin=0.1, pmax=100, filter=True, smooth=None):
         """Filters with pmax = pmax, then returns ACF up to lag=2*pmax
         """
         if filter:
-            if self._x_full is None:
-                self._get_data()
-
-            x, y, yerr = bandpass_filter(self._x_full,
-                                         self._y_full,
-                                         self._yerr_full, zero_fill=True,
-                                         pmin=pmin, pmax=pmax)
+            x, y, yerr = bandpass_filter(*self._full_arrays(), zero_fill=True,
+                                         pmin=pmin, pmax=pmax,
+                                         cadence=self.cadence)
         else:
             x, y = self.x, self.y
 
@@ -129,8 +348,16 @@ class LightCurve(object):
                  fig_kwargs=None, savefig_filename=None):
         """Returns best guess of prot from ACF, and height of peak
 
-        Just pick first peak.
+        Just pick first peak.  Results are cached (unless plotting), so
+        repeated calls (e.g., by `plan_chunks` and the model's ACF prior)
+        are free.
         """
+        if ax is not None:
+            plot = True
+        key = (pmin, pmax, delta, lookahead, peak_to_trough, maxpeaks)
+        if not plot and self._acf_cache is not None and key in self._acf_cache:
+            return self._acf_cache[key]
+
         lags, ac = self.acf(pmin=pmin, pmax=pmax, smooth=pmax/10)
 
         # make sure lookahead isn't too long if pmax is small
@@ -194,8 +421,6 @@ class LightCurve(object):
         quality =  1./ (fit.fun / len(lags) / maxheight)
         quality *= tau/pbest # enhance quality for long decay timescales.
 
-        if ax is not None:
-            plot = True
         if plot:
             if ax is None:
                 fig, ax = plt.subplots(1,1)
@@ -221,48 +446,141 @@ class LightCurve(object):
             else:
                 return pbest, maxheight, tau, quality, fig
         else:
+            if self._acf_cache is None:
+                self._acf_cache = {}
+            self._acf_cache[key] = (pbest, maxheight, tau, quality)
             return pbest, maxheight, tau, quality
 
-    def best_sublc(self, ndays, npoints=600, chunksize=300,
-                    flat_order=3, **kwargs):
-        """Returns new sub-LightCurve, choosing ndays with maximum RMS variation 
+    def _rolling_std(self, flat_order=3, nsigma=5):
+        """Shared rolling detrended-rms engine for full-resolution data
+        """
+        key = (flat_order, nsigma)
+        if self._rolling is None or self._rolling[0] != key:
+            x, y, _ = self._full_arrays()
+            m = sigma_clip_mask(y, nsigma)
+            engine = RollingPolyVariance(x, y, order=flat_order, mask=m)
+            self._rolling = (key, engine)
+        return self._rolling[1]
+
+    def _best_window(self, ndays, flat_order=3):
+        """Returns (i1, i2, rms) of ndays window with maximum rms variation
+
+        i1 and i2 are None if no window fits in the data.
         """
         x_full = self.x_full
-        y_full = self.y_full
 
         N = len(x_full)
         cadence = np.median(x_full[1:] - x_full[:-1])
         window = int(ndays / cadence)
-        stepsize = window//50
-        i1 = 0
-        i2 = i1 + window
-        max_std = 0
-        max_i1 = None
-        max_i2 = None
-        while i2 < N:
-            x = x_full[i1:i2].copy()
-            y = y_full[i1:i2].copy()
-            x, y, _ = sigma_clip(x, y, y, 5)
-            p = np.polyfit(x, y, flat_order)
-            y -= np.polyval(p, x)
-            std = np.std(y)
-            if std > max_std:
-                max_i1 = i1
-                max_i2 = i2
-                max_std = std
-            i1 += stepsize
-            i2 += stepsize
+        stepsize = max(window//50, 1)
+
+        i1 = np.arange(0, N - window, stepsize)
+        if window > flat_order + 1 and len(i1) > 0:
+            std = self._rolling_std(flat_order).std(i1, i1 + window)
+            if np.isfinite(std).any():
+                imax = np.nanargmax(std)
+                return i1[imax], i1[imax] + window, std[imax]
+        return None, None, np.nan
+
+    def best_sublc(self, ndays, npoints=600, chunksize=300,
+                    flat_order=3, seed=None, **kwargs):
+        """Returns new sub-LightCurve, choosing ndays with maximum RMS variation 
+
+        Windows are ranked by rms about a polynomial of order flat_order,
+        after sigma-clipping the full light curve once.  All window sizes
+        are evaluated from the same precomputed moments.
+        """
+        x_full, y_full, yerr_full = self._full_arrays()
+
+        cadence = np.median(x_full[1:] - x_full[:-1])
+        window = int(ndays / cadence)
+        max_i1, max_i2, _ = self._best_window(ndays, flat_order=flat_order)
 
         x, y, yerr = (x_full[max_i1:max_i2], 
                       y_full[max_i1:max_i2], 
-                      self.yerr_full[max_i1:max_i2])
+                      yerr_full[max_i1:max_i2])
 
         newname = self.name + '_{:.0f}d'.format(ndays)
-        if 'sub' not in kwargs:
-            kwargs['sub'] = window//npoints
+        sub = kwargs.pop('sub', window//npoints)
+
+        lc = LightCurve(x, y, yerr, chunksize=chunksize,
+                        name=newname, **kwargs)
+        for attr in self._chunk_options:
+            setattr(lc, attr, getattr(self, attr))
+        lc.sub = sub
+        lc.subsample(sub, seed=seed)
+        return lc
+
+    def plan_chunks(self, period=None, tau=None,
+                    ndays=(800, 400, 200, 100, 50, 25), npoints=600,
+                    budget=None, min_gain=0.05, precision=0.01,
+                    flat_order=3, acf_pmax=128):
+        """Chooses window sizes for make_best_chunks by expected information
+
+        Each candidate window (the highest-variability window of each size
+        in ndays, subsampled to npoints) is scored with a Fisher-information
+        proxy for ln(period), treating the signal as a sinusoid that stays
+        coherent for the ACF decay time tau:
+
+            I = npoints * SNR**2 * (2 pi min(ndays, tau) / period)**2 / 12,
+
+        where SNR is the window's rms variability over the white noise per
+        point.  Windows are added in order of decreasing I until the next
+        one would add less than min_gain of the information so far, the
+        total number of points would exceed budget, or the expected
+        uncertainty in ln(period), 1/sqrt(sum(I)), is already below
+        precision.  budget defaults to twice the cost of the three fixed
+        scales of `make_best_chunks`, so that stars with little signal get
+        more points, and strong signals fewer, than the fixed scheme.
+
+        period and tau default to the ACF estimates (`acf_prot` with
+        pmax=acf_pmax; by default the longest ACF of the model's period
+        prior, which is then computed only once).  If there is no ACF
+        period, returns the default scales of `make_best_chunks`.
+
+        Returns list of window sizes (days).
+        """
+        if period is None or tau is None:
+            p_acf, _, tau_acf, _ = self.acf_prot(pmax=acf_pmax)
+            if period is None:
+                period = p_acf
+            if tau is None:
+                tau = tau_acf
+        if not np.isfinite(period) or period <= 0:
+            return [800, 200, 50]
+        if tau is None or not np.isfinite(tau):
+            tau = np.inf
+        if budget is None:
+            budget = 2 * 3 * npoints
+
+        # White noise per point, from point-to-point scatter.
+        y_full = self.y_full
+        dy = np.diff(y_full[np.isfinite(y_full)])
+        noise = 1.4826 * np.median(np.absolute(dy)) / np.sqrt(2)
+
+        info = []
+        for nd in ndays:
+            i1, _, rms = self._best_window(nd, flat_order=flat_order)
+            if i1 is None:
+                continue
+            snr2 = max(rms**2 - noise**2, 0) / noise**2 if noise > 0 else np.inf
+            baseline = min(nd, tau)
+            info.append((npoints * snr2 * (2*np.pi*baseline/period)**2 / 12, nd))
+
+        info.sort(reverse=True)
+        plan = []
+        total = 0.
+        for I, nd in info:
+            if plan and (I < min_gain * total or
+                         (len(plan) + 1) * npoints > budget or
+                         total > 1. / precision**2):
+                break
+            plan.append(nd)
+            total += I
 
-        return LightCurve(x, y, yerr, chunksize=chunksize,
-                          name=newname, **kwargs)        
+        if not plan:
+            return [800, 200, 50]
+        return plan
 
     def make_best_chunks(self, ndays=[800, 200, 50], seed=None, **kwargs):
         if not hasattr(ndays, '__iter__'):
@@ -272,33 +590,36 @@ class LightCurve(object):
         self._y_list = []
         self._yerr_list = []
 
-        np.random.seed(seed)
+        rng = np.random.RandomState(seed)
         for nd in ndays:
-            lc = self.best_sublc(nd, **kwargs)
+            lc = self.best_sublc(nd, seed=rng.randint(2**31), **kwargs)
             self._x_list += lc.x_list
             self._y_list += lc.y_list
             self._yerr_list += lc.yerr_list
 
+        if isinstance(self._full, np.memmap):
+            # Don't keep in-memory copy of full data around.
+            self._rolling = None
+
     def multi_split_quarters(self, qtrs, subs, seed=None):
-        self._x_list = []
-        self._y_list = []
-        self._yerr_list = []
-        np.random.seed(seed)
+        rng = np.random.RandomState(seed)
+        inds = []
         for qtr, sub in zip(qtrs, subs):
-            t0, t1 = qtr_times.ix[qtr]
-            m = (self.x_full >= t0) & (self.x_full <= t1)
-            N = int(m.sum())
-            # print(N, sub, N//sub)
-            if N==0:
+            if qtr not in self.qtr_index:
                 continue
-            inds = np.sort(np.random.choice(N, int(N//sub), replace=False))
-            self._x_list.append(self.x_full[m][inds])
-            self._y_list.append(self.y_full[m][inds])
-            self._yerr_list.append(self.yerr_full[m][inds])
+            sl = self.qtr_index[qtr]
+            N = sl.stop - sl.start
+            # print(N, sub, N//sub)
+            inds.append(sl.start + np.sort(rng.choice(N, int(N//sub),
+                                                      replace=False)))
 
-        self.x = np.concatenate(self._x_list)
-        self.y = np.concatenate(self._y_list)
-        self.yerr = np.concatenate(self._yerr_list)
+        splits = np.cumsum([len(i) for i in inds])[:-1]
+        inds = np.concatenate(inds)
+        self._set_working(self._full[:, inds], full_index=inds)
+        chunks = np.split(self._data, splits, axis=1)
+        self._x_list = [c[0] for c in chunks]
+        self._y_list = [c[1] for c in chunks]
+        self._yerr_list = [c[2] for c in chunks]
 
     def multi_split_quarters_rms(self, subs=None,
                                  seed=None):
@@ -312,65 +633,225 @@ class LightCurve(object):
     def _split_quarters(self):
         if not hasattr(self, 'quarters'):
             raise AttributeError('Cannot split quarters if quarters not defined.')
-        self._x_list = []
-        self._y_list = []
-        self._yerr_list = []
-
-        for qtr, (t0, t1) in qtr_times.iterrows():
-            if self.quarters is not None and qtr not in self.quarters:
-                continue
-            m = (self.x >= t0) & (self.x <= t1)
-            if m.sum()==0:
-                continue
-            self._x_list.append(self.x[m])
-            self._y_list.append(self.y[m])
-            self._yerr_list.append(self.yerr[m])
+        index = quarter_slices(self.x, self.quarters)
+        chunks = [self._data[:, sl] for sl in index.values()]
+        self._x_list = [c[0] for c in chunks]
+        self._y_list = [c[1] for c in chunks]
+        self._yerr_list = [c[2] for c in chunks]
 
     def _make_chunks(self, chunksize=None):
+        """Splits working data into chunks of at most chunksize points
+
+        By default, chunks have equal numbers of points.  If
+        `adaptive_chunks` is set, chunk boundaries are first put at
+        gaps in the full-resolution data longer than `chunk_maxgap`
+        (default 5 times the median cadence) and, if `chunk_quarters` is
+        set, at Kepler quarter boundaries.  Segments of fewer than half
+        the target chunk size (the total number of points divided by
+        the least number of chunks of at most chunksize points) are
+        merged into a neighbouring segment, unless gaps separate them
+        from both (then they are left as small chunks).  Each segment is then split into
+        equal-count chunks, as close to the target size as possible but
+        of at most chunksize points and (if `chunk_maxspan` is set) at
+        most chunk_maxspan days, so chunks are balanced across segments.
+        """
         if chunksize is None:
             if self.chunksize is None:
                 return
             chunksize = self.chunksize
-        nall = len(self.x)
-        N = len(self.x) // chunksize 
-        # Ensure chunks *no larger* than chunksize.
-        if not nall % chunksize == 0:
-            N += 1
         self.chunksize = chunksize
-        self._x_list = np.array_split(self.x, N)
-        self._y_list = np.array_split(self.y, N)
-        self._yerr_list = np.array_split(self.yerr, N)
+        if self.adaptive_chunks:
+            # Bounds depend only on time sampling, so light curves with
+            # identical times share them (times are hashed once per
+            # rechunking, which is cheaper than finding the bounds).
+            bounds = get_structure('chunk_bounds', self.x,
+                                   lambda x, *args: self._chunk_bounds(chunksize),
+                                   chunksize, times_key(self.x_full),
+                                   self.chunk_maxgap, self.chunk_maxspan,
+                                   self.chunk_quarters)
+            chunks = [self._data[:, i0:i1]
+                      for i0, i1 in zip(bounds[:-1], bounds[1:])]
+        else:
+            nall = len(self.x)
+            N = len(self.x) // chunksize 
+            # Ensure chunks *no larger* than chunksize.
+            if not nall % chunksize == 0:
+                N += 1
+            chunks = np.array_split(self._data, N, axis=1)
+        self._x_list = [c[0] for c in chunks]
+        self._y_list = [c[1] for c in chunks]
+        self._yerr_list = [c[2] for c in chunks]
+
+    def _chunk_bounds(self, chunksize):
+        """Returns index boundaries of gap-aware chunks (see _make_chunks)
+        """
+        x = self.x
+        N = len(x)
+        if N == 0:
+            return np.array([0])
+
+        # Find gaps in full-resolution data, so that (e.g.) random
+        # subsampling does not create spurious gaps.
+        x_full = self.x_full
+        dx = np.diff(x_full)
+        maxgap = self.chunk_maxgap
+        if maxgap is None:
+            maxgap = 5 * np.median(dx) if len(dx) > 0 else np.inf
+        tgap = x_full[1:][dx > maxgap]
+        tbreak = tgap
+        if self.chunk_quarters:
+            tbreak = np.concatenate((tbreak, qtr_times['tstart'].values))
+        i = np.searchsorted(x, tbreak)
+        segments = np.unique(np.concatenate(([0, N], i[(i > 0) & (i < N)])))
+        at_gap = np.in1d(segments, np.searchsorted(x, tgap))
+
+        # Common target chunk size for all segments.
+        target = N / -(-N // chunksize)
+
+        # Merge segments too small to be worth their own chunk into the
+        # neighbour with the shorter break between them, but never
+        # across a gap.
+        small = np.diff(segments) < max(target / 2, 1)
+        keep = np.ones(len(segments), dtype=bool)
+        for j in np.flatnonzero(small):
+            sides = [b for b in (j, j + 1)
+                     if 0 < b < len(segments) - 1 and not at_gap[b]]
+            if sides:
+                b = min(sides, key=lambda b: x[segments[b]] - x[segments[b] - 1])
+                keep[b] = False
+        segments = segments[keep]
+
+        bounds = [0]
+        for i0, i1 in zip(segments[:-1], segments[1:]):
+            n = i1 - i0
+            k = max(-(-n // chunksize), int(np.round(n / target)), 1)
+            if self.chunk_maxspan is not None:
+                span = x[i1 - 1] - x[i0]
+                k = max(k, int(np.ceil(span / self.chunk_maxspan)))
+            k = min(k, n)
+            bounds.extend(i0 + (np.arange(1, k + 1) * n) // k)
+        return np.array(bounds)
+
+    def uniform_chunks(self, cadence=None, max_fill=0.05, rtol=1e-6):
+        """Fills gaps within chunks so that each is evenly sampled
+
+        Gap fillers (see `fill_gaps`) are marked as unobserved in
+        `observed_list`, so the likelihood ignores them, but evenly
+        sampled chunks have Toeplitz covariance (see `GPRotModel`).
+        Each unobserved point costs one more O(N^2) Toeplitz solve, so
+        chunks that would need more than max_fill of their points filled
+        (e.g., randomly subsampled ones) are left as they are.  Time
+        stamps are only put on an exact grid if they are within rtol (of
+        the time step) of it already; otherwise (e.g., for drifting
+        cadence) the chunk is left as it is, too.  Chunks left unevenly
+        sampled are logged, and use the dense likelihood.
+        """
+        x_list, y_list, yerr_list = [], [], []
+        masks = []
+        nuneven = 0
+        for x, y, yerr in zip(self.x_list, self.y_list, self.yerr_list):
+            c = cadence
+            if c is None:
+                c = np.median(np.diff(x)) if len(x) > 1 else 1.
+            new_x, new_y, new_yerr, i_new = fill_gaps(x, y, yerr, cadence=c,
+                                                      make_uniform=False)
+            uniform = len(i_new) <= max_fill * len(new_x) and len(new_x) > 1
+            if uniform:
+                step = (new_x[-1] - new_x[0]) / (len(new_x) - 1)
+                grid = new_x[0] + step * np.arange(len(new_x))
+                uniform = np.all(np.absolute(new_x - grid) <= rtol * step)
+            if uniform:
+                new_x = grid
+            else:
+                new_x, new_y, new_yerr, i_new = x, y, yerr, []
+                nuneven += 1
+            m = np.ones(len(new_x), dtype=bool)
+            m[i_new] = False
+            x_list.append(new_x)
+            y_list.append(new_y)
+            yerr_list.append(new_yerr)
+            masks.append(m)
+
+        if nuneven > 0:
+            logging.warning('{}: {} of {} chunks could not be made evenly '
+                            'sampled.'.format(self.name, nuneven, len(x_list)))
+
+        self._x_list = x_list
+        self._y_list = y_list
+        self._yerr_list = yerr_list
+        self._observed = (x_list, masks)
+
+    @property
+    def observed_list(self):
+        """Masks of observed (not gap-filler) points in chunks, or None
+        """
+        if self._observed is None or self._observed[0] is not self._x_list:
+            return None
+        return self._observed[1]
 
     def chunk_rms(self, t0, t1, nsigma=5):
         """Returns rms flux variability between t0 and t1
 
         """
-        m = (self.x_full >= t0) & (self.x_full <= t1)
-        if m.sum()==0:
+        i0 = np.searchsorted(self.x_full, t0, side='left')
+        i1 = np.searchsorted(self.x_full, t1, side='right')
+        if i1 <= i0:
             return np.nan
-        x = self.x_full[m].copy()
-        y = self.y_full[m].copy()
-        yerr = self.yerr_full[m].copy()
+        x = self.x_full[i0:i1]
+        y = self.y_full[i0:i1]
 
-        x, y, yerr = sigma_clip(x, y, yerr, nsigma)
+        ok = sigma_clip_mask(y, nsigma)
+        x = x[ok]
+        y = y[ok]
 
         p = np.polyfit(x, y, 1)
-        y -= np.polyval(p, x)
+        y = y - np.polyval(p, x)
 
         med = np.median(y)
-        std = (sum((med - y)**2)/float(len(y)))**.5
+        std = np.sqrt(np.mean((y - med)**2))
 
         return std
 
+    @property
+    def qtr_index(self):
+        """OrderedDict of quarter -> slice of full-resolution arrays
+        """
+        if self._qtr_index is None:
+            self._qtr_index = quarter_slices(self.x_full,
+                                             getattr(self, 'quarters', None))
+        return self._qtr_index
+
     def qtr_rms(self, nsigma=5):
-        rms_all = {}
-        for qtr, (t0, t1) in qtr_times.iterrows():
-            if self.quarters is not None and qtr not in self.quarters:
-                continue
-            rms = self.chunk_rms(t0, t1, nsigma=nsigma)
-            if np.isfinite(rms):
-                rms_all[qtr] = rms
-        return rms_all
+        """Returns dictionary of rms variability about a line, per quarter
+
+        Each quarter is sigma-clipped separately; the linear fits and rms
+        for all quarters are then computed together from per-quarter sums.
+        """
+        index = self.qtr_index
+        if len(index) == 0:
+            return {}
+        x = self.x_full
+        y = self.y_full
+
+        # Points outside any quarter or clipped get zero weight.
+        w = np.zeros(len(x))
+        t = np.zeros(len(x))
+        for sl in index.values():
+            w[sl] = sigma_clip_mask(y[sl], nsigma)
+            t[sl] = x[sl] - x[sl].mean()
+
+        starts = [sl.start for sl in index.values()]
+        n, st, stt, sy, sty, syy = [np.add.reduceat(v, starts) for v in
+                                    (w, w*t, w*t*t, w*y, w*t*y, w*y*y)]
+
+        # Residual sum of squares after least-squares linear fit.
+        det = n*stt - st**2
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rss = syy - (sy*(stt*sy - st*sty) + sty*(n*sty - st*sy)) / det
+            rms = np.sqrt(np.maximum(rss, 0) / n)
+
+        return OrderedDict((qtr, r) for qtr, r in zip(index.keys(), rms)
+                           if np.isfinite(r))
 
     @property
     def x_list(self):
@@ -394,30 +875,113 @@ class LightCurve(object):
     def is_split(self):
         return self.x_list is not None
 
-    def sigma_clip(self, nsigma):
-        self.x, self.y, self.yerr = sigma_clip(self.x, self.y, self.yerr, nsigma)
+    @property
+    def mask(self):
+        """Boolean mask of working points not (yet) rejected
 
-    def restrict_range(self, rng):
-        m = (self.x > rng[0]) & (self.x < rng[1])
-        self.x = self.x[m]
-        self.y = self.y[m]
-        self.yerr = self.yerr[m]
+        None if there are no pending rejections.
+        """
+        return self._mask
+
+    def _init_mask(self):
+        if self._data is None:
+            self._get_data()
+        if self._mask is None:
+            self._mask = np.ones(self._data.shape[1], dtype=bool)
+        return self._mask
+
+    def apply_mask(self):
+        """Removes masked points from working arrays, then resets mask
+        """
+        m = self._mask
+        if m is None:
+            return
+        self._mask = None
+        if not m.all():
+            index = self._full_index
+            self._set_working(self._data[:, m],
+                              full_index=None if index is None else index[m])
+
+    def sigma_clip(self, nsigma, maxiter=1, robust=False, compress=True):
+        """Sigma-clips working arrays
+
+        If compress is False, clipped points are only flagged in self.mask,
+        so several rejection steps can be combined before the arrays
+        are copied once (by apply_mask, or on next access of x, y, yerr).
+        """
+        m = self._init_mask()
+        sigma_clip_mask(self._data[1], nsigma, maxiter=maxiter, robust=robust,
+                        mask=m)
+        if compress:
+            self.apply_mask()
+
+    def restrict_range(self, rng, compress=True):
+        m = self._init_mask()
+        x = self._data[0]
+        m &= (x > rng[0]) & (x < rng[1])
+        if compress:
+            self.apply_mask()
 
     def subsample(self, sub, seed=None):
         """Random subsampling
         """
         if sub is None:
             return
+        if sub <= 1:
+            # Keeps every point; no need to copy.
+            return
         N = len(self.x)
-        np.random.seed(seed)
-        inds = np.sort(np.random.choice(N, N//sub, replace=False))
-        self.x = self.x[inds]
-        self.y = self.y[inds]
-        self.yerr = self.yerr[inds]
+        rng = np.random.RandomState(seed)
+        inds = np.sort(rng.choice(N, N//sub, replace=False))
+        index = self._full_index
+        self._set_working(self._data[:, inds],
+                          full_index=None if index is None else index[inds])
+
+    def bin(self, nbin, maxgap=None):
+        """Weighted binning of working arrays, as alternative to subsample
+
+        Averages groups of nbin consecutive points (with inverse-variance
+        weights and propagated errors), without binning across gaps
+        longer than maxgap; see `gprot.binning.bin_weighted`.  The binning
+        is remembered, and reapplied if the data are filtered.
+        """
+        if nbin is None or nbin <= 1:
+            return
+        self.nbin = nbin
+        self.bin_maxgap = maxgap
+        self._set_working(np.array(bin_weighted(self.x, self.y, self.yerr,
+                                                nbin, maxgap=maxgap)))
+
+    def coarsened(self, nbin, maxgap=None):
+        """Returns new LightCurve with each chunk binned by nbin
+
+        Chunks are kept as they are (binned separately, see `bin`), so the
+        new light curve is a cheaper, lower-resolution version of this
+        one for likelihood evaluation.
+        """
+        if self.x_list is None:
+            pieces = [(self.x, self.y, self.yerr)]
+        else:
+            pieces = zip(self.x_list, self.y_list, self.yerr_list)
+            if self.observed_list is not None:
+                # Leave out gap fillers.
+                pieces = [(x[m], y[m], yerr[m]) for (x, y, yerr), m
+                          in zip(pieces, self.observed_list)]
+        chunks = [bin_weighted(x, y, yerr, nbin, maxgap=maxgap)
+                  for x, y, yerr in pieces]
+
+        x, y, yerr = [np.concatenate(c) for c in zip(*chunks)]
+        lc = LightCurve(x, y, yerr, chunksize=None,
+                        name=self.name + '_bin{}'.format(nbin))
+        if self.x_list is not None:
+            lc._x_list = [c[0] for c in chunks]
+            lc._y_list = [c[1] for c in chunks]
+            lc._yerr_list = [c[2] for c in chunks]
+        return lc
 
     def polyflat(self, order=3):
         p = np.polyfit(self.x, self.y, order)
-        self.y -= np.polyval(p, self.x)
+        self.y = self.y - np.polyval(p, self.x)
 
     def plot(self, ax=None, **kwargs):
         if ax is None:
@@ -442,49 +1006,76 @@ class LightCurve(object):
 
     @property
     def x(self):
-        if self._x is None:
+        if self._data is None:
             self._get_data()
-        return self._x
+        self.apply_mask()
+        return self._data[0]
 
     @property
     def y(self):
-        if self._y is None:
+        if self._data is None:
             self._get_data()
-        return self._y
+        self.apply_mask()
+        return self._data[1]
 
     @property
     def yerr(self):
-        if self._yerr is None:
+        if self._data is None:
             self._get_data()
-        return self._yerr
+        self.apply_mask()
+        return self._data[2]
 
     @property
     def x_full(self):
-        if self._x_full is None:
+        if self._full is None:
             self._get_data()
-        return self._x_full
+        return self._full[0]
 
     @property
     def y_full(self):
-        if self._y_full is None:
+        if self._full is None:
             self._get_data()
-        return self._y_full
+        return self._full[1]
 
     @property
     def yerr_full(self):
-        if self._yerr_full is None:
+        if self._full is None:
             self._get_data()
-        return self._yerr_full
+        return self._full[2]
+
+    def _set_row(self, i, val):
+        """Sets row i (x, y or yerr) of working data
+
+        If val has a different length, the working buffer is rebuilt, and
+        its other rows are NaN until they are set too.
+        """
+        if self._data is None:
+            self._get_data()
+        self.apply_mask()
+        val = np.asarray(val, dtype=float)
+        if val.shape != self._data[i].shape:
+            data = np.empty((3,) + val.shape)
+            data.fill(np.nan)
+            data[i] = val
+            self._set_working(data)
+            return
+        # New buffer rather than in-place change, so that models may
+        # recognize unchanged data by their buffer.
+        self._data = self._data.copy()
+        self._data[i] = val
+        self._full_index = None
+        self._x_list = None
+        self._y_list = None
+        self._yerr_list = None
 
     @x.setter
     def x(self, val):
-        self._x = val
+        self._set_row(0, val)
         
     @y.setter
     def y(self, val):
-        self._y = val
+        self._set_row(1, val)
 
     @yerr.setter
     def yerr(self, val):
-        self._yerr = val
-
+        self._set_row(2, val)
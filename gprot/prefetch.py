@@ -0,0 +1,76 @@
+from __future__ import print_function, division
+
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+class Loaded(object):
+    """Result of a background load: call `get` to return it, or re-raise
+    the exception raised while loading.
+    """
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    def get(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+class Prefetcher(object):
+    """Calls load(key) for each key in a background thread, staying
+    up to `depth` keys ahead of the consumer.
+
+    Iterating yields (key, Loaded) in order, so that e.g. the next stars'
+    light curves are read and chunked while the current star is sampled.
+    `load` can be anything, e.g. a function that builds a `LightCurve`
+    using a fake kplr client or a local directory of FITS files.
+
+    Parameters
+    ----------
+    keys : iterable
+        Keys (e.g., star IDs) to load.
+
+    load : callable
+        Function of one key.
+
+    depth : int
+        Maximum number of loaded items waiting to be consumed.
+    """
+    def __init__(self, keys, load, depth=2):
+        self.keys = list(keys)
+        self.load = load
+        self.depth = depth
+
+        self._queue = Queue(maxsize=max(depth, 1))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        for key in self.keys:
+            if self._stop.is_set():
+                return
+            try:
+                item = Loaded(value=self.load(key))
+            except Exception as e:
+                item = Loaded(error=e)
+            self._queue.put((key, item))
+
+    def __iter__(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        try:
+            for _ in self.keys:
+                yield self._queue.get()
+        finally:
+            self.close()
+
+    def close(self):
+        """Stops background loading, discarding anything not yet consumed
+        """
+        self._stop.set()
+        while not self._queue.empty():
+            self._queue.get()
@@ -0,0 +1,56 @@
+from __future__ import print_function, division
+
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+# Process-wide cache of structures (chunk layouts, lag vectors and
+# matrices of chunks, low-rank lag matrices) that depend only on time
+# sampling, shared by all models in a process; e.g., all Aigrain stars
+# have the same time stamps.  Looking up x hashes it, so callers should
+# look up each time array once (e.g., per chunk), not on every call.
+_structures = OrderedDict()
+_nbytes = [0]
+
+# Least recently used structures are dropped beyond this total size.
+max_bytes = 256 * 2**20
+
+def times_key(x):
+    """Returns hash key of time array x
+    """
+    x = np.ascontiguousarray(x, dtype=float)
+    return (len(x), hashlib.sha1(x.tobytes()).hexdigest())
+
+def _size(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_size(v) for v in value)
+    return 0
+
+def get_structure(name, x, build, *args):
+    """Returns build(x, *args), cached by name, time array x and args
+
+    build must depend only on x and args (not on fluxes or errors).
+    Returned arrays are shared, and must not be modified.
+    """
+    key = (name, times_key(x)) + args
+    if key in _structures:
+        value = _structures.pop(key)
+    else:
+        value = build(x, *args)
+        for v in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(v, np.ndarray):
+                v.flags.writeable = False
+        _nbytes[0] += _size(value)
+    _structures[key] = value
+
+    while _nbytes[0] > max_bytes and len(_structures) > 1:
+        _, old = _structures.popitem(last=False)
+        _nbytes[0] -= _size(old)
+    return value
+
+def clear_structures():
+    _structures.clear()
+    _nbytes[0] = 0
@@ -0,0 +1,85 @@
+from __future__ import print_function, division
+
+import numpy as np
+from scipy.linalg import solve_toeplitz
+
+def uniform_step(x, rtol=1e-6):
+    """Returns time step if x is evenly spaced (to rtol), else None
+    """
+    if len(x) < 2:
+        return None
+    dx = np.diff(x)
+    step = (x[-1] - x[0]) / (len(x) - 1)
+    if step > 0 and np.all(np.absolute(dx - step) <= rtol * step):
+        return step
+    return None
+
+def toeplitz_logdet(c):
+    """Log-determinant of symmetric Toeplitz matrix with first column c
+
+    Uses the Durbin recursion: O(N^2) operations and O(N) memory, without
+    forming the matrix.  Raises `np.linalg.LinAlgError` if the matrix is
+    not positive definite.
+    """
+    c = np.asarray(c, dtype=float)
+    N = len(c)
+    if c[0] <= 0:
+        raise np.linalg.LinAlgError('Toeplitz matrix not positive definite.')
+    r = c[1:] / c[0]
+
+    logdet = N * np.log(c[0])
+    if N == 1:
+        return logdet
+
+    # Durbin: predictor coefficients y, prediction error variance beta.
+    y = np.empty(N - 1)
+    y[0] = -r[0]
+    beta = 1.
+    alpha = -r[0]
+    for k in range(1, N):
+        beta *= (1. - alpha * alpha)
+        if beta <= 0:
+            raise np.linalg.LinAlgError('Toeplitz matrix not positive definite.')
+        logdet += np.log(beta)
+        if k == N - 1:
+            break
+        alpha = -(r[k] + np.dot(r[k-1::-1], y[:k])) / beta
+        y[:k] += alpha * y[k-1::-1]
+        y[k] = alpha
+    return logdet
+
+def toeplitz_lnlike(c, y, mask=None):
+    """Gaussian log-likelihood of y for Toeplitz covariance with first column c
+
+    If mask is given, only y[mask] are observed (e.g., the others are
+    gap fillers on a uniform grid), and the exact likelihood of the
+    observed points is computed from the Toeplitz matrix of the full grid,
+    using one extra Levinson solve per unobserved point: O(N^2 (1 + m))
+    for m unobserved points, which beats the O(N^3) dense factorization
+    only for m << N.
+    """
+    y = np.asarray(y, dtype=float)
+    if mask is not None and mask.all():
+        mask = None
+
+    z = y if mask is None else np.where(mask, y, 0.)
+    alpha = solve_toeplitz(c, z)
+    quad = np.dot(z, alpha)
+    logdet = toeplitz_logdet(c)
+    n = len(y)
+
+    if mask is not None:
+        # Condition out unobserved points with the Schur complement of
+        # the inverse: K_oo^-1 = P_oo - P_om P_mm^-1 P_mo, P = T^-1.
+        missing = np.flatnonzero(~mask)
+        E = np.zeros((len(y), len(missing)))
+        E[missing, np.arange(len(missing))] = 1.
+        P_mm = solve_toeplitz(c, E)[missing]
+        a_m = alpha[missing]
+        cho = np.linalg.cholesky(P_mm)
+        w = np.linalg.solve(cho, a_m)
+        quad -= np.dot(w, w)
+        logdet += 2 * np.sum(np.log(np.diag(cho)))
+        n -= len(missing)
+
+    return -0.5 * (quad + logdet + n * np.log(2*np.pi))